@@ -2,4 +2,11 @@ from run import *
 from task import *
 from resource import *
 from utils import *
+from compression import *
+from cache import *
+from state import *
+from stream import *
 
+from pool import *
+from lock import *
+from distributed import *
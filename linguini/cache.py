@@ -0,0 +1,210 @@
+import os
+import errno
+import shutil
+import hashlib
+
+
+def link_or_copy(source, dest, link=False):
+	'''
+		Copies `source` to `dest`, or if `link` is True, hard-links it, 
+		falling back on copying if linking isn't possible (e.g. across 
+		devices).  Anything at `dest` is replaced.
+	'''
+	dest_dir = os.path.dirname(dest)
+	if dest_dir and not os.path.isdir(dest_dir):
+		os.makedirs(dest_dir)
+
+	if os.path.lexists(dest):
+		os.remove(dest)
+
+	if link:
+		try:
+			os.link(source, dest)
+			return
+		except OSError as e:
+			if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+				raise
+
+	# copy under a temporary name, so `dest` is never left half written
+	tmp_path = '%s.tmp-%d' % (dest, os.getpid())
+	shutil.copy2(source, tmp_path)
+	os.rename(tmp_path, dest)
+
+
+class OutputCache(object):
+	'''
+		A local content-addressable store of task outputs.  Outputs are
+		stored under a key made from the task's class, its parameters,
+		whether it is a pilot, and the checksums of its inputs.  The lot is
+		not part of the key, so a task in one lot can reuse the outputs
+		computed by an identical task in another lot.
+
+		By default, outputs are copied into and out of the store.  With 
+		`link=True` they are hard-linked instead, which costs no space or 
+		copying, but an output that is then rewritten in place (e.g. an
+		IncrementalFile, or anything made with `atomic=False`) changes the
+		stored entry, and every lot it was restored to.
+
+		When `max_bytes` is given, the least recently used entries are
+		evicted to keep the store below that size.
+	'''
+
+	def __init__(self, path, max_bytes=None, link=False):
+		self.path = path
+		self.max_bytes = max_bytes
+		self.link = link
+
+
+	def get_key(self, task):
+		'''
+			Returns the key for `task`, or None if the task can't be cached
+			(its inputs or outputs aren't file-based, or it consumes inputs
+			incrementally, so its outputs depend on more than its inputs).
+		'''
+		outputs = task.get_all_outputs()
+		if len(outputs) == 0:
+			return None
+
+		if any([o.get_files() is None for o in outputs]):
+			return None
+
+		input_checksums = []
+		for input in task.get_all_inputs():
+			if getattr(input, 'incremental', False):
+				return None
+			checksum = input.checksum()
+			if checksum is None:
+				return None
+			input_checksums.append(checksum)
+
+		identity = '%s.%s\t%r\t%r\t%s' % (
+			task.__class__.__module__, task.__class__.__name__,
+			task._hashable_parameters, bool(task.get_pilot()),
+			','.join(sorted(input_checksums))
+		)
+		return hashlib.sha1(identity).hexdigest()
+
+
+	def get_entry_path(self, key):
+		return os.path.join(self.path, key[:2], key)
+
+
+	def get_sorted_outputs(self, task):
+		# outputs are stored by their position when sorted by file name,
+		# which does not depend on the lot
+		return sorted(task.get_all_outputs(), key=lambda o: o.fname)
+
+
+	def restore(self, task):
+		'''
+			If outputs for `task` are in the store, puts them in place and
+			returns True.  Otherwise returns False.
+		'''
+		key = self.get_key(task)
+		if key is None:
+			return False
+
+		entry_path = self.get_entry_path(key)
+		index_path = os.path.join(entry_path, 'index')
+		if not os.path.isfile(index_path):
+			return False
+
+		outputs = self.get_sorted_outputs(task)
+		for line in open(index_path):
+			position, suffix, stored_name, size = line.rstrip('\n').split('\t')
+			target = outputs[int(position)].get_path() + suffix
+			link_or_copy(
+				os.path.join(entry_path, stored_name), target, self.link)
+
+		# record the use, for LRU eviction
+		os.utime(index_path, None)
+		return True
+
+
+	def store(self, task):
+		'''
+			Adds the outputs of `task` to the store, if it can be cached.
+		'''
+		key = self.get_key(task)
+		if key is None:
+			return
+
+		entry_path = self.get_entry_path(key)
+		if os.path.isdir(entry_path):
+			os.utime(os.path.join(entry_path, 'index'), None)
+			return
+
+		# fill a temporary entry, then move it into place in one step, so
+		# that concurrent runners never see a half-written entry
+		tmp_path = '%s.tmp-%d' % (entry_path, os.getpid())
+		if os.path.isdir(tmp_path):
+			shutil.rmtree(tmp_path)
+		os.makedirs(tmp_path)
+
+		lines = []
+		outputs = self.get_sorted_outputs(task)
+		for position, output in enumerate(outputs):
+			root = output.get_path()
+			for path in sorted(output.get_files()):
+				stored_name = str(len(lines))
+				link_or_copy(
+					path, os.path.join(tmp_path, stored_name), self.link)
+				lines.append('%d\t%s\t%s\t%d\n' % (
+					position, path[len(root):], stored_name,
+					os.path.getsize(path)
+				))
+
+		with open(os.path.join(tmp_path, 'index'), 'w') as f:
+			f.writelines(lines)
+
+		try:
+			os.rename(tmp_path, entry_path)
+		except OSError:
+			# another runner stored the same entry first
+			shutil.rmtree(tmp_path)
+
+		if self.max_bytes is not None:
+			self.evict()
+
+
+	def get_entries(self):
+		'''
+			Returns a list of `(last_used, size, entry_path)` for every entry.
+		'''
+		entries = []
+		if not os.path.isdir(self.path):
+			return entries
+
+		for prefix in os.listdir(self.path):
+			prefix_path = os.path.join(self.path, prefix)
+			for key in os.listdir(prefix_path):
+				entry_path = os.path.join(prefix_path, key)
+				index_path = os.path.join(entry_path, 'index')
+				if not os.path.isfile(index_path):
+					continue
+				size = sum([
+					int(line.rstrip('\n').split('\t')[3])
+					for line in open(index_path)
+				])
+				entries.append(
+					(os.path.getmtime(index_path), size, entry_path))
+
+		return entries
+
+
+	def evict(self):
+		'''
+			Removes least recently used entries until the store is no larger
+			than `max_bytes`.
+		'''
+		entries = sorted(self.get_entries())
+		total = sum([size for last_used, size, entry_path in entries])
+		while total > self.max_bytes and entries:
+			last_used, size, entry_path = entries.pop(0)
+			shutil.rmtree(entry_path, ignore_errors=True)
+			total -= size
+
+
+	def clear(self):
+		if os.path.isdir(self.path):
+			shutil.rmtree(self.path)
@@ -0,0 +1,164 @@
+import bz2
+import gzip
+import zlib
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+# lzma is only in the standard library from python 3.3
+try:
+	import lzma
+except ImportError:
+	try:
+		from backports import lzma
+	except ImportError:
+		lzma = None
+
+
+# the compression inferred from a file's extension
+EXTENSIONS = {
+	'.gz': 'gzip',
+	'.bz2': 'bz2',
+	'.xz': 'lzma',
+	'.lzma': 'lzma',
+}
+
+
+class CompressionException(Exception):
+	pass
+
+
+def infer_compression(fname):
+	for extension, compress in EXTENSIONS.items():
+		if fname.endswith(extension):
+			return compress
+
+	return False
+
+
+def open_compressed(path, mode, compress, threads=1):
+	'''
+		Opens `path` with the codec named by `compress` ('gzip', 'bz2', or
+		'lzma'), or as a plain file if `compress` is False.  Writing gzip
+		with more than one thread uses a ParallelGzipWriter.
+	'''
+
+	if not compress:
+		return open(path, mode)
+
+	if compress == 'gzip':
+		if threads > 1 and ('w' in mode or 'a' in mode):
+			return ParallelGzipWriter(path, mode, threads=threads)
+		return gzip.open(path, mode)
+
+	if compress == 'bz2':
+		if 'a' in mode:
+			raise CompressionException(
+				'bz2 files cannot be opened for appending: %s' % path)
+		return bz2.BZ2File(path, mode)
+
+	if compress == 'lzma':
+		if lzma is None:
+			raise CompressionException(
+				'lzma compression needs python 3.3+, or backports.lzma: %s'
+				% path
+			)
+		return lzma.open(path, mode)
+
+	raise CompressionException('unknown compression: %s' % compress)
+
+
+def compress_block(data, level):
+	# each block becomes a complete gzip member (wbits=31 makes zlib write
+	# the gzip header and trailer).  zlib releases the GIL while deflating,
+	# so blocks really are compressed in parallel.
+	compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+	return compressor.compress(data) + compressor.flush()
+
+
+class ParallelGzipWriter(object):
+	'''
+		A writable file-like object that produces a multi-member gzip file.
+		Writes are gathered into blocks of `block_size` bytes, each of which
+		is compressed into its own gzip member by a pool of threads.
+		Members are written in order, and any gzip reader (including the
+		gzip module and `zcat`) reads the concatenation as a single stream.
+	'''
+
+	def __init__(
+			self, path, mode='w', threads=4, level=6, block_size=2**20
+		):
+		self.name = path
+		self.level = level
+		self.block_size = block_size
+		self.threads = threads
+		self.closed = False
+
+		self.fh = open(path, 'ab' if 'a' in mode else 'wb')
+		self.pool = ThreadPool(threads)
+		self.pending = deque()
+		self.buffer = []
+		self.buffered = 0
+
+
+	def write(self, data):
+		if self.closed:
+			raise ValueError('I/O operation on closed file')
+
+		self.buffer.append(data)
+		self.buffered += len(data)
+		if self.buffered >= self.block_size:
+			self._submit()
+
+
+	def writelines(self, lines):
+		for line in lines:
+			self.write(line)
+
+
+	def _submit(self):
+		if self.buffered == 0:
+			return
+
+		data = ''.join(self.buffer)
+		self.buffer, self.buffered = [], 0
+		self.pending.append(
+			self.pool.apply_async(compress_block, (data, self.level)))
+
+		# bound the number of blocks held in memory
+		while len(self.pending) > 2 * self.threads:
+			self.fh.write(self.pending.popleft().get())
+
+
+	def flush(self):
+		self._submit()
+		while self.pending:
+			self.fh.write(self.pending.popleft().get())
+		self.fh.flush()
+
+
+	def close(self):
+		if self.closed:
+			return
+
+		try:
+			self.flush()
+		finally:
+			self.pool.close()
+			self.pool.join()
+			self.fh.close()
+			self.closed = True
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+
+	def __del__(self):
+		try:
+			self.close()
+		except Exception:
+			pass
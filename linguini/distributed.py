@@ -0,0 +1,255 @@
+import sys
+import time
+import errno
+import select
+import socket
+import struct
+import traceback
+try:
+	import cPickle as pickle
+except ImportError:
+	import pickle
+
+
+def send_message(sock, obj):
+	'''
+		Sends a pickled object, preceded by its length.
+	'''
+	data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+	sock.sendall(struct.pack('!I', len(data)) + data)
+
+
+def receive_exactly(sock, size):
+	chunks = []
+	while size > 0:
+		chunk = sock.recv(min(size, 2**16))
+		if not chunk:
+			return None
+		chunks.append(chunk)
+		size -= len(chunk)
+
+	return ''.join(chunks)
+
+
+def receive_message(sock):
+	'''
+		Receives an object sent with `send_message`.  Returns None if the
+		connection was closed.
+	'''
+	header = receive_exactly(sock, 4)
+	if header is None:
+		return None
+
+	data = receive_exactly(sock, struct.unpack('!I', header)[0])
+	if data is None:
+		return None
+
+	return pickle.loads(data)
+
+
+def get_class_path(task):
+	return '%s.%s' % (task.__class__.__module__, task.__class__.__name__)
+
+
+def load_class(class_path):
+	module_name, class_name = class_path.rsplit('.', 1)
+	__import__(module_name)
+	return getattr(sys.modules[module_name], class_name)
+
+
+def make_job(task, task_name, clobber):
+	'''
+		Describes a task by the path of its class, and the arguments it was
+		constructed with, so that a worker can rebuild it.
+	'''
+	return {
+		'name': task_name,
+		'class': get_class_path(task),
+		'args': task.args['args'],
+		'kwargs': task.args['kwargs'],
+		'lot': task.get_lot(),
+		'pilot': task.get_pilot(),
+		'clobber': clobber,
+	}
+
+
+def build_task(job):
+	task = load_class(job['class'])(*job['args'], **job['kwargs'])
+	task.get_ready(job['lot'], job['pilot'], job['name'], job['clobber'])
+	return task
+
+
+def connect(address, timeout=30):
+	'''
+		Connects to the coordinator at `address`, retrying until `timeout`
+		seconds have passed, so workers can be started before it.
+	'''
+	give_up = time.time() + timeout
+	while True:
+		try:
+			return socket.create_connection(address)
+		except socket.error as e:
+			if e.errno != errno.ECONNREFUSED or time.time() > give_up:
+				raise
+			time.sleep(0.1)
+
+
+def work(address, timeout=30):
+	'''
+		Runs tasks sent by the coordinator at `address`, until it shuts down.
+		Task classes must be importable by the worker, and the data
+		directories must be shared with the coordinator.
+	'''
+	sock = connect(address, timeout)
+	try:
+		while True:
+			job = receive_message(sock)
+			if job is None:
+				break
+
+			report = {'name': job['name'], 'host': socket.gethostname()}
+			start = time.time()
+			try:
+				build_task(job)._run()
+			except Exception:
+				report['error'] = traceback.format_exc()
+
+			report['duration'] = time.time() - start
+			send_message(sock, report)
+
+	finally:
+		sock.close()
+
+
+class Coordinator(object):
+	'''
+		Runs a readied runner's schedule by handing ready tasks to workers
+		that connect over TCP (see `work`).  The runner still decides what
+		to run, skips tasks that turn out to be up to date, and records what
+		changed; the workers only run tasks.
+
+		Messages are pickled, so the coordinator and its workers should only
+		be reachable from a trusted network.
+	'''
+
+	def __init__(self, runner, address):
+		self.runner = runner
+		self.address = address
+		self.idle = []
+		self.running = {}
+		self.previous = {}
+		self.failures = runner.failures
+
+
+	def get_ready_tasks(self):
+		runner = self.runner
+		ready = []
+		for task_name in sorted(runner.schedule):
+			if task_name in self.running.values():
+				continue
+			dependencies = runner.get_dependencies(task_name)
+			if any([d in runner.schedule for d in dependencies]):
+				continue
+			ready.append(task_name)
+
+		return ready
+
+
+	def dispatch_ready(self):
+		# skipping a task that's up to date can make others ready
+		dispatched = True
+		while dispatched and not self.runner.is_stopping(self.failures):
+			dispatched = False
+			for task_name in self.get_ready_tasks():
+				if len(self.idle) == 0:
+					return
+				self.dispatch(task_name)
+				dispatched = True
+
+
+	def dispatch(self, task_name):
+		'''
+			Sends the task to an idle worker, unless it's up to date.
+		'''
+		runner = self.runner
+		if runner.skip_up_to_date(task_name):
+			return
+
+		task = runner.get_task(task_name)
+		runner.prepare_task(task_name, task)
+		self.previous[task_name] = runner.get_previous_checksums(
+			task_name, task)
+
+		sock = self.idle.pop(0)
+		clobber = task_name in runner.reasons or task.get_clobber()
+		send_message(sock, make_job(task, task_name, clobber))
+		self.running[sock] = task_name
+
+
+	def finish(self, sock, report):
+		runner = self.runner
+		task_name = self.running.pop(sock)
+		if report is None:
+			report = {'name': task_name, 'error': 'the worker disconnected'}
+			sock.close()
+		else:
+			self.idle.append(sock)
+
+		if 'error' in report:
+			self.failures.append(report)
+			if runner.keep_going:
+				runner.block(task_name)
+			return
+
+		print '\tINFO: %s ran on %s in %.2fs' % (
+			task_name, report['host'], report['duration'])
+		task = runner.get_task(task_name)
+		runner.durations[task_name] = report['duration']
+		runner.record_outputs(task_name, task, self.previous.pop(task_name))
+		runner.release_inputs(task)
+		runner.schedule.remove(task_name)
+		runner.expand(task_name)
+
+
+	def run(self):
+		'''
+			Runs the schedule, and returns the reports of tasks that failed.
+			Once a task fails, no more tasks are started.
+		'''
+		listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		listener.bind(self.address)
+		listener.listen(16)
+		print '\tINFO: waiting for workers on %s:%d' % listener.getsockname()
+
+		try:
+			while True:
+
+				# hand out whatever can be run
+				self.dispatch_ready()
+				if len(self.running) == 0 and (
+					len(self.runner.schedule) == 0 
+					or self.runner.is_stopping(self.failures)
+				):
+					break
+
+				# wait for new workers and reports
+				watched = [listener] + self.idle + self.running.keys()
+				readable = select.select(watched, [], [], 1)[0]
+				for sock in readable:
+					if sock is listener:
+						self.idle.append(listener.accept()[0])
+					elif sock in self.running:
+						self.finish(sock, receive_message(sock))
+
+					# an idle worker has nothing to say, so it hung up
+					else:
+						self.idle.remove(sock)
+						sock.close()
+
+		finally:
+			for sock in self.idle + self.running.keys():
+				sock.close()
+			listener.close()
+
+		return self.failures
@@ -0,0 +1,134 @@
+import os
+import time
+import errno
+import socket
+import threading
+
+
+class TaskLock(object):
+	'''
+		A lock file claiming a task for one runner process.  The file is
+		created atomically, and while it is held, a thread touches it every
+		`heartbeat` seconds.  A lock whose file hasn't been touched for
+		`timeout` seconds belongs to a runner that died, and can be broken.
+
+		Staleness is judged by watching the file's mtime (and inode) change,
+		rather than comparing it to the clock, so that runners on machines
+		whose clocks disagree (e.g. sharing a directory over NFS) still agree.
+	'''
+
+	def __init__(self, path, timeout=60, heartbeat=10):
+		self.path = path
+		self.timeout = timeout
+		self.heartbeat = heartbeat
+		self.owner = '%s:%d' % (socket.gethostname(), os.getpid())
+		self.held = False
+		self.seen_version = None
+		self.seen_at = None
+		self.stop_beating = threading.Event()
+		self.beater = None
+
+
+	def acquire(self):
+		'''
+			Tries to take the lock, breaking it if it's stale.  Returns True
+			if the lock is now held, and False if another runner holds it.
+		'''
+		lock_dir = os.path.dirname(self.path)
+		if lock_dir and not os.path.isdir(lock_dir):
+			try:
+				os.makedirs(lock_dir)
+			except OSError as e:
+				if e.errno != errno.EEXIST:
+					raise
+
+		try:
+			fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+		except OSError as e:
+			if e.errno != errno.EEXIST:
+				raise
+			if self.is_stale():
+				self.break_lock()
+				return self.acquire()
+			return False
+
+		os.write(fd, self.owner)
+		os.close(fd)
+		self.held = True
+		self.stop_beating.clear()
+		self.beater = threading.Thread(target=self.beat)
+		self.beater.daemon = True
+		self.beater.start()
+		return True
+
+
+	def get_version(self, path):
+		# a lock file is replaced by a new one, or touched, when its inode
+		# or mtime changes
+		info = os.stat(path)
+		return (info.st_ino, info.st_mtime)
+
+
+	def is_stale(self):
+		try:
+			version = self.get_version(self.path)
+		except OSError:
+			return False
+
+		if version != self.seen_version:
+			self.seen_version = version
+			self.seen_at = time.time()
+			return False
+
+		return time.time() - self.seen_at > self.timeout
+
+
+	def break_lock(self):
+		# move the stale lock aside first, so that only one of the runners
+		# that find it stale gets to remove it
+		stale_path = '%s.stale.%s' % (self.path, self.owner)
+		try:
+			os.rename(self.path, stale_path)
+		except OSError as e:
+			if e.errno != errno.ENOENT:
+				raise
+			return
+
+		# another runner may have broken the lock and taken a fresh one
+		# since it was judged stale, and that's what was moved, so put it 
+		# back (unless yet another lock was taken in the meantime)
+		if self.get_version(stale_path) != self.seen_version:
+			try:
+				os.link(stale_path, self.path)
+			except OSError as e:
+				if e.errno != errno.EEXIST:
+					raise
+			os.remove(stale_path)
+			return
+
+		print '\tWARNING: broke stale lock %s' % self.path
+		os.remove(stale_path)
+		self.seen_version = None
+
+
+	def beat(self):
+		while not self.stop_beating.wait(self.heartbeat):
+			try:
+				os.utime(self.path, None)
+			except OSError:
+				print '\tWARNING: lost lock %s' % self.path
+				return
+
+
+	def release(self):
+		if not self.held:
+			return
+
+		self.stop_beating.set()
+		self.beater.join()
+		try:
+			os.remove(self.path)
+		except OSError as e:
+			if e.errno != errno.ENOENT:
+				raise
+		self.held = False
@@ -0,0 +1,113 @@
+import multiprocessing
+
+
+class Worker(object):
+	'''
+		A worker process that takes jobs from its own queue, by calling
+		`serve(jobs, results)` in the process.  Keeps track of the task
+		classes whose `worker_init` has run in the process.
+	'''
+
+	def __init__(self, serve, results):
+		self.jobs = multiprocessing.Queue()
+		self.initialized = set()
+		self.process = multiprocessing.Process(
+			target=serve, args=(self.jobs, results))
+		self.process.daemon = True
+		self.process.start()
+
+
+	def submit(self, job, initializers):
+		self.initialized |= set(initializers)
+		self.jobs.put(job)
+
+
+	def stop(self):
+		self.jobs.put(None)
+		self.process.join()
+
+
+	def terminate(self):
+		self.process.terminate()
+		self.process.join()
+
+
+	def is_alive(self):
+		return self.process.is_alive()
+
+
+	@property
+	def exitcode(self):
+		return self.process.exitcode
+
+
+class WorkerPool(object):
+	'''
+		Hands out up to `size` workers.  When `warm` is True, workers are
+		kept alive between jobs, and jobs are routed to idle workers that
+		have already initialized the task classes they need.  Otherwise,
+		each job gets a fresh worker.
+	'''
+
+	def __init__(self, size, serve, warm=False):
+		self.size = size
+		self.serve = serve
+		self.warm = warm
+		self.results = multiprocessing.Queue()
+		self.idle = []
+		self.busy = []
+
+
+	def get_worker(self, initializers=()):
+		'''
+			Returns a worker for a job whose tasks need `initializers`, or
+			None if all workers are busy.
+		'''
+		initializers = set(initializers)
+
+		# prefer the idle worker that has the most of them initialized
+		if len(self.idle) > 0:
+			worker = max(
+				self.idle,
+				key=lambda w: len(w.initialized & initializers)
+			)
+			warm_enough = initializers <= worker.initialized
+
+			# a fresh worker is as good as one warmed up for other tasks
+			if warm_enough or len(self.idle) + len(self.busy) >= self.size:
+				self.idle.remove(worker)
+				self.busy.append(worker)
+				return worker
+
+		if len(self.idle) + len(self.busy) >= self.size:
+			return None
+
+		worker = Worker(self.serve, self.results)
+		self.busy.append(worker)
+		return worker
+
+
+	def release(self, worker):
+		self.busy.remove(worker)
+		if self.warm and worker.is_alive():
+			self.idle.append(worker)
+		else:
+			worker.stop()
+
+
+	def discard(self, worker):
+		# kills a worker whose job is no longer needed
+		self.busy.remove(worker)
+		worker.terminate()
+
+
+	def close(self):
+		'''
+			Stops idle workers, and kills busy ones.
+		'''
+		for worker in self.idle:
+			worker.stop()
+		for worker in self.busy:
+			worker.terminate()
+		self.idle = []
+		self.busy = []
@@ -1,12 +1,38 @@
 import os
+import sys
+import mmap
+import stat
+import shutil
+import hashlib
+try:
+	import cPickle as pickle
+except ImportError:
+	import pickle
 from datetime import datetime
 from utils import saves_args
+from compression import infer_compression, open_compressed
+from stream import TeeWriter
 
 
 class ResourceException(Exception):
 	pass
 
 
+def checksum_file(path, block_size=2**20):
+	'''
+		Returns the hex sha1 digest of the file at `path`, reading it in
+		blocks so that large files needn't fit in memory.
+	'''
+	digest = hashlib.sha1()
+	with open(path, 'rb') as f:
+		block = f.read(block_size)
+		while block:
+			digest.update(block)
+			block = f.read(block_size)
+
+	return digest.hexdigest()
+
+
 class Resource(object):
 
 
@@ -108,21 +134,288 @@ class Resource(object):
 		)
 
 
+	def finalize(self):
+		'''
+			Called once the task that yields this resource has finished
+			running successfully.  Resources that need to record their
+			completion (e.g. by writing a manifest) should override this.
+		'''
+		pass
+
+
+	def has_unconsumed(self):
+		'''
+			Indicates whether this resource, used as an input, holds data 
+			that the task hasn't processed yet.  Only incremental resources 
+			ever do.
+		'''
+		return False
+
+
+	def mark_consumed(self):
+		'''
+			Called once the task using this resource as an input has finished
+			running successfully.
+		'''
+		pass
+
+
+	def register_consumer(self):
+		'''
+			Called by the runner, for each input of each scheduled task, 
+			before any tasks run.
+		'''
+		pass
+
+
+	def release(self):
+		'''
+			Called by the runner, for each input of a scheduled task, once
+			that task is finished with it.
+		'''
+		pass
+
+
+	def spill(self):
+		'''
+			Writes any of the resource's data that is held only in this 
+			process's memory to disk.
+		'''
+		pass
+
+
+	def stage(self, tag):
+		'''
+			Makes the resource write its data to a staging location named by
+			`tag`, rather than in place, until `commit` or `discard` is 
+			called.
+		'''
+		pass
+
+
+	def commit(self):
+		'''
+			Moves the staged data into place, and stops staging.
+		'''
+		pass
+
+
+	def discard(self):
+		'''
+			Removes the staged data, and stops staging.
+		'''
+		pass
+
+
+	def get_files(self):
+		'''
+			Lists the paths of the files that hold this resource's data, or
+			returns None if its data doesn't live in files.  Every path 
+			starts with `get_path()`.
+		'''
+		return None
+
+
+	def checksum(self):
+		'''
+			Returns a hex sha1 digest of the resource's data, or None if it
+			can't be computed.
+		'''
+		files = self.get_files()
+		if files is None:
+			return None
+
+		digest = hashlib.sha1()
+		root = self.get_path()
+		for path in sorted(files):
+			digest.update('%s\t%s\n' % (path[len(root):], checksum_file(path)))
+
+		return digest.hexdigest()
+
+
 	def copy(self):
 		return self.__class__(*self.args['args'], **self.args['kwargs'])
 
 
+class ReadOnlyMap(mmap.mmap):
+	'''
+		A read-only memory map of the file at `path`.  The pages are shared 
+		with the OS page cache, and with any processes forked after the map
+		is made.  When pickled (e.g. to send it to a pool worker), the 
+		receiving process maps the same file afresh, so nothing is copied.
+	'''
+
+	def __new__(cls, path):
+		with open(path, 'rb') as f:
+			mapped = super(ReadOnlyMap, cls).__new__(
+				cls, f.fileno(), 0, access=mmap.ACCESS_READ)
+		mapped.path = path
+		return mapped
+
+
+	def __init__(self, path):
+		pass
+
+
+	def __reduce__(self):
+		return (ReadOnlyMap, (self.path,))
+
+
+# the loaded forms of broadcast files in this process, keyed by path, with
+# the (inode, mtime) of the file they were loaded from
+broadcasts = {}
+
+
+class FileRange(object):
+	'''
+		A view of the bytes from `start` up to (not including) `end` of the
+		file at `path`.  Ranges made by `File.split` begin and end on line
+		boundaries.  A range only holds the path and offsets, so it can be
+		pickled and sent to another process, which opens it independently.
+	'''
+
+	def __init__(self, path, start, end):
+		self.path = path
+		self.start = start
+		self.end = end
+
+
+	def __len__(self):
+		return self.end - self.start
+
+
+	def open(self):
+		return RangeReader(self.path, self.start, self.end)
+
+
+	def __iter__(self):
+		return iter(self.open())
+
+
+	def __repr__(self):
+		return 'FileRange(%r, %d, %d)' % (self.path, self.start, self.end)
+
+
+class RangeReader(object):
+	'''
+		A read-only file-like object over one byte range of a file.
+	'''
+
+	def __init__(self, path, start, end):
+		self.fh = open(path, 'rb')
+		self.fh.seek(start)
+		self.remaining = end - start
+
+
+	def read(self, size=-1):
+		if size < 0 or size > self.remaining:
+			size = self.remaining
+		data = self.fh.read(size)
+		self.remaining -= len(data)
+		return data
+
+
+	def readline(self):
+		if self.remaining <= 0:
+			return ''
+		line = self.fh.readline(self.remaining)
+		self.remaining -= len(line)
+		return line
+
+
+	def __iter__(self):
+		return self
+
+
+	def next(self):
+		line = self.readline()
+		if not line:
+			raise StopIteration
+		return line
+
+
+	def close(self):
+		self.fh.close()
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+
 class File(Resource):
+	'''
+		A file that is namespaced to the lot (and pilot).  The file is read
+		and written through the codec named by `compress` ('gzip', 'bz2', or
+		'lzma'); by default this is inferred from the extension of `fname`, 
+		and `compress=False` forces plain reading and writing.  Writing gzip 
+		with `threads` > 1 compresses blocks in parallel.
+
+		An input made with `stream=True` is one that the task reads once, 
+		sequentially.  The runner may then run the task at the same time as
+		the task that writes the file, and pipe the data between them.  The
+		file is still written as well, unless the writing task declares it
+		with `persist=False`.
+
+		A file made with `broadcast=True` is read-only data used by many 
+		tasks.  It is loaded once per process, and in parallel runs, the 
+		runner loads it before starting workers, which then share it rather
+		than loading their own copies.  Warm workers are started once, so 
+		they share the broadcast files that exist when the run starts (and
+		aren't rewritten by it), but load their own copies of the others.
+		A file is loaded again if it changed since it was loaded.
+
+		Memory maps (File and ArrayFile) are shared outright.  Objects 
+		loaded from a PickleFile are only shared until python touches them:
+		updating an object's reference count writes to its page, which the
+		worker then gets a copy of.  Large arrays are best kept in an 
+		ArrayFile.
+
+		As an output, the file is written under a temporary name, and only
+		renamed into place once the task succeeds, so an interrupted task 
+		never leaves a partial file that looks complete.  Use `atomic=False`
+		to write in place.
+	'''
 
 	@saves_args
 	def __init__(self, path, fname, **kwargs):
 		self.path = path
 		self.fname = fname
+		self.compress = kwargs.pop('compress', None)
+		self.threads = kwargs.pop('threads', 1)
+		self.stream = kwargs.pop('stream', False)
+		self.persist = kwargs.pop('persist', True)
+		self.broadcast = kwargs.pop('broadcast', False)
+		self.atomic = kwargs.pop('atomic', True)
+		self.pipe = None
+		self.staged = None
 		super(File, self).__init__(**kwargs)
 
 
+	def get_compression(self, fname=None, compress=None):
+		if compress is not None:
+			return compress
+
+		if self.compress is not None:
+			return self.compress
+
+		return infer_compression(fname or self.fname)
+
+
 	def get_path(self):
 
+		# while staged, the data is written next to where it belongs
+		if self.staged is not None:
+			return '%s.%s' % (self.get_final_path(), self.staged)
+
+		return self.get_final_path()
+
+
+	def get_final_path(self):
+
 		# ensure the resource is ready
 		if not self.is_ready():
 			raise ResourceException('Resource is not ready.')
@@ -142,19 +435,62 @@ class File(Resource):
 	def exists(self):
 		return os.path.isfile(self.get_path())
 
+
+	def get_files(self):
+		if not self.exists():
+			return []
+		return [self.get_path()]
+
+
+	def stage(self, tag):
+		# a file that is already staged keeps its tag
+		if self.staged is None:
+			self.staged = tag
+
+
+	def commit(self):
+		if self.staged is None:
+			return
+
+		# files are renamed over those in place, which is atomic
+		staged_root = self.get_path()
+		staged_files = self.get_files() or []
+		self.staged = None
+		root = self.get_path()
+		for path in staged_files:
+			os.rename(path, root + path[len(staged_root):])
+
+
+	def discard(self):
+		if self.staged is None:
+			return
+
+		for path in self.get_files() or []:
+			os.remove(path)
+		self.staged = None
+
+
 	def open(self, flags):
 
+		# when connected to another task by a pipe, read from the pipe
+		if self.pipe is not None and 'r' in flags:
+			return self.pipe.reader
+
+		# and write to it (and the file too, unless it isn't persisted)
+		if self.pipe is not None and not self.persist:
+			return TeeWriter(self.pipe)
+
 		# avoid clobbering files (if that's not what we're told to do)
 		if 'w' in flags:
 
 			# if writing, check whether the file exists
-			if os.path.isfile(self.get_path()):
+			if os.path.isfile(self.get_final_path()):
 				if self.get_clobber():
-					print '\t INFO: clobbered %s' % self.get_path()
+					print '\t INFO: clobbered %s' % self.get_final_path()
 				else:
 					raise IOError(
 						'File: by default, I refuse to overwrite files. '
-						+ self.get_path()
+						+ self.get_final_path()
 					)
 
 		# if we're opining in a write mode, then make dirs if needed
@@ -162,8 +498,114 @@ class File(Resource):
 			if not os.path.isdir(self.get_dir()):
 				os.makedirs(self.get_dir())
 
-		# hands over a plain file handle
-		return open(self.get_path(), flags)
+			# what was loaded for broadcast is out of date
+			broadcasts.pop(self.get_final_path(), None)
+
+			# appending to a staged file starts from what's in place
+			path = self.get_path()
+			if 'a' in flags and path != self.get_final_path():
+				if os.path.isfile(self.get_final_path()) and (
+					not os.path.exists(path)
+				):
+					shutil.copy2(self.get_final_path(), path)
+
+		# hands over a file handle, wrapped in the codec if any
+		fh = open_compressed(
+			self.get_path(), flags, self.get_compression(), self.threads)
+
+		if self.pipe is not None:
+			return TeeWriter(self.pipe, fh)
+
+		return fh
+
+
+	def mmap(self):
+		'''
+			Returns a read-only memory map of the file, so that large inputs
+			can be read randomly without copying them onto the heap.
+		'''
+		if self.get_compression():
+			raise ResourceException(
+				'File: compressed files cannot be memory mapped. ' 
+				+ self.get_path()
+			)
+
+		if self.broadcast:
+			return self.get_broadcast()
+
+		return ReadOnlyMap(self.get_path())
+
+
+	def get_broadcast(self):
+		'''
+			Returns the shared, loaded form of the file, loading it if this
+			process hasn't yet.
+		'''
+		path = self.get_path()
+		info = os.stat(path)
+		version = (info.st_ino, info.st_mtime)
+
+		# a file rewritten since (e.g. by a task in another worker) is 
+		# loaded again
+		if path not in broadcasts or broadcasts[path][0] != version:
+			broadcasts[path] = (version, self.load_broadcast())
+		return broadcasts[path][1]
+
+
+	def load_broadcast(self):
+		# memory maps are shared by processes forked after they are made
+		return ReadOnlyMap(self.get_path())
+
+
+	def buffer(self):
+		'''
+			Returns a zero-copy, read-only buffer over the file's contents,
+			suitable for e.g. `numpy.frombuffer`.  This is a memoryview where
+			the mmap supports it, and a python 2 buffer otherwise.
+		'''
+		# empty files can't be mapped, but their contents are known
+		if os.path.getsize(self.get_path()) == 0:
+			return memoryview('')
+
+		mapped = self.mmap()
+		try:
+			return memoryview(mapped)
+		except TypeError:
+			return buffer(mapped)
+
+
+	def split(self, num_ranges):
+		'''
+			Divides the file into `num_ranges` FileRanges of roughly equal 
+			size, each beginning and ending on a line boundary, so that 
+			separate processes can read parts of the file in parallel.  Some
+			ranges may be empty if the file has fewer lines than ranges.
+		'''
+		if self.get_compression():
+			raise ResourceException(
+				'File: compressed files cannot be split. ' + self.get_path())
+
+		path = self.get_path()
+		size = os.path.getsize(path)
+		boundaries = [0]
+		with open(path, 'rb') as f:
+			for i in range(1, num_ranges):
+				target = max(size * i // num_ranges, boundaries[-1])
+
+				# move to the start of the first line that begins at or after
+				# the target (a line beginning right at it is kept whole)
+				if target > 0:
+					f.seek(target - 1)
+					f.readline()
+					target = f.tell()
+
+				boundaries.append(min(target, size))
+
+		boundaries.append(size)
+		return [
+			FileRange(path, start, end) 
+			for start, end in zip(boundaries[:-1], boundaries[1:])
+		]
 
 
 class MarkerResource(File):
@@ -189,39 +631,111 @@ class MarkerResource(File):
 		self.open('a').write('%s\n' % str(datetime.now()))
 
 
-class IncrementalFile(object):
+class IncrementalFile(File):
 	'''
-		This is like a file resource, but we don't rely on the existence of
-		the file to determine whether the resource is satisfied.  We use a
-		separate "marker" file, that is created when the resource is marked
-		as done (by calling mark_as_done()).  This file contains a timestamp
-		of when the resource was marked done according to local machine's time
+		This is like a file resource, but the data is written in `num_parts`
+		separate parts, and we don't rely on the existence of the parts to 
+		determine whether they are done.  We use a separate "marker" file per
+		part, that is created when the part is marked as done (by calling 
+		mark_as_done()).  This file contains a timestamp of when the part was
+		marked done according to local machine's time.
+
+		The resource exists once every part is marked done.  A task that is
+		interrupted can resume by only writing the parts listed by 
+		`remaining()`.  Parts that were partially written but never marked
+		are overwritten without complaint.
 	'''
 
 	@saves_args
-	def __init__(self, path, fname, part_name):
-		self.path = path
-		self.fname = fname
-		self.part_name = part_name
+	def __init__(self, path, fname, num_parts, **kwargs):
+		self.num_parts = num_parts
+
+		# parts are kept when a task is interrupted, so it can resume
+		kwargs.setdefault('atomic', False)
+		super(IncrementalFile, self).__init__(path, fname, **kwargs)
+
+
+	def get_part_path(self, part):
+		if part < 0 or part >= self.num_parts:
+			raise IndexError(
+				'IncrementalFile: no part %d in %s' % (part, self.get_path()))
+		return '%s.part%d' % (self.get_path(), part)
+
+
+	def get_marker_path(self, part):
+		return self.get_part_path(part) + '.marker'
+
+
+	def is_done(self, part):
+		return os.path.isfile(self.get_marker_path(part))
+
+
+	def remaining(self):
+		'''
+			Lists the parts that have not been marked as done, in order.  When
+			clobbering, the markers from earlier runs are removed the first
+			time this is called, so every part is redone.
+		'''
+		if self.get_clobber() and not getattr(self, '_clobbered', False):
+			for part in range(self.num_parts):
+				if self.is_done(part):
+					os.remove(self.get_marker_path(part))
+			self._clobbered = True
+
+		return [p for p in range(self.num_parts) if not self.is_done(p)]
+
 
-		
 	def exists(self):
-		return os.path.isfile(get_marker_path)
+		return all([self.is_done(p) for p in range(self.num_parts)])
 
 
-	def get_marker_path(self):
-		return self.get_path() + '.' + self.part_name + '.marker'
+	def get_files(self):
+		paths = []
+		for part in range(self.num_parts):
+			paths.extend([self.get_part_path(part), self.get_marker_path(part)])
+		return [p for p in paths if os.path.isfile(p)]
 
 
-	def mark_as_done(self):
+	def open(self, part, flags):
+
+		# parts that were marked done are protected, unless clobbering.
+		# parts that were not marked done are leftovers from an interruption.
+		if 'w' in flags and self.is_done(part):
+			if self.get_clobber():
+				print '\t INFO: clobbered %s' % self.get_part_path(part)
+			else:
+				raise IOError(
+					'IncrementalFile: by default, I refuse to overwrite parts '
+					'that are done. ' + self.get_part_path(part)
+				)
+
+		if 'a' in flags or 'w' in flags:
+			if not os.path.isdir(self.get_dir()):
+				os.makedirs(self.get_dir())
+
+		return open_compressed(
+			self.get_part_path(part), flags, self.get_compression(), 
+			self.threads
+		)
+
+
+	def __iter__(self):
+		'''
+			Yields the paths of all the parts, in order.
+		'''
+		return iter([self.get_part_path(p) for p in range(self.num_parts)])
+
+
+	def mark_as_done(self, part):
 		# note that this will create a marker file with the current time
 		# stamp.  In general, it should never be called if there is an existing
 		# file already by the same name, however, if that does happen somehow
 		# it will append to the file.
-		marker_fh = open(self.get_marker_path(), 'a')
+		if not os.path.isdir(self.get_dir()):
+			os.makedirs(self.get_dir())
+		marker_fh = open(self.get_marker_path(part), 'a')
 		marker_fh.write('%s\n' % str(datetime.now()))
-
-
+		marker_fh.close()
 
 
 class Folder(File):
@@ -229,14 +743,50 @@ class Folder(File):
 		Creates (if necessary) a folder that is namepsaced to the lot, 
 		and allows reading and writing files there.  File names are not
 		namespaced (because the folder is).
+
+		When the task that fills the folder finishes, a manifest listing
+		the name and size (and, if `checksum=True`, the sha1) of each file
+		is written inside the folder.  The folder `exists` if its manifest
+		does, so checking completeness doesn't require scanning the folder.
+
+		As an output, the folder is filled under a temporary name, and 
+		swapped into place once the task succeeds, so a task that fails 
+		leaves no partial files for its rerun to trip over.  A folder that
+		accumulates files over several runs should be made with 
+		`atomic=False`, to be written in place.
+
+		As an input, a folder made with `incremental=True` only yields the
+		files that were added or changed (by size or mtime) since the task 
+		last ran successfully.  The files consumed are kept in a ledger
+		under `ledger_path`, namespaced to the task's lot and name.  When 
+		clobbering, the ledger is ignored and every file is yielded.
 	'''
 
+	manifest_fname = '.linguini_manifest'
+	ledger_path = './linguini_markers'
+
 	@saves_args
 	def __init__(self, path, dirname, *args, **kwargs):
 		self.whitelist = kwargs.pop('whitelist', None)
 		self.blacklist = kwargs.pop('blacklist', None)
+		self.checksum = kwargs.pop('checksum', False)
+		self.incremental = kwargs.pop('incremental', False)
+		self.ledger_path = kwargs.pop('ledger_path', self.ledger_path)
 		super(Folder, self).__init__(path, dirname, *args, **kwargs)
 
+
+	def get_ready(self, lot, pilot, name, clobber):
+		super(Folder, self).get_ready(lot, pilot, name, clobber)
+
+		# the ledger belongs to the consuming task, so it takes the task's
+		# lot and pilot, even if the folder itself is static
+		if self.incremental:
+			self.ledger = File(
+				self.ledger_path, '%s_%s.consumed' % (name, self.fname))
+			self.ledger.get_ready(lot, pilot, name, clobber)
+			self._new_files = None
+
+
 	def get_fname(self, fname):
 		return os.path.join(self.get_path(), fname)
 
@@ -268,32 +818,58 @@ class Folder(File):
 				% self.get_fname(fname)
 			)
 
+		# writing to the folder means it is no longer known to be complete
+		if 'w' in mode or 'a' in mode:
+			self.remove_manifest()
+
 		# if we're opening in write mode, don't overwrite an existing file
 		# unless in clobber mode
-		if 'w' in mode and os.path.isfile(self.get_fname(fname)):
+		final_fname = os.path.join(self.get_final_path(), fname)
+		if 'w' in mode and os.path.isfile(final_fname):
 
 			if self.get_clobber():
-				print '\tINFO: clobbered %s' % self.get_fname(fname)
+				print '\tINFO: clobbered %s' % final_fname
 
 			else:
 				raise IOError(
 					'Folder: a file already exists there. '
-					'I do not overwrite by default: %s' % self.get_fname(fname)
+					'I do not overwrite by default: %s' % final_fname
 				)
 
+		# appending to a file in a staged folder starts from what's in place
+		if 'a' in mode and final_fname != self.get_fname(fname):
+			if os.path.isfile(final_fname) and (
+				not os.path.exists(self.get_fname(fname))
+			):
+				shutil.copy2(final_fname, self.get_fname(fname))
+
 
-	def open(self, fname, mode):
+	def open(self, fname, mode, compress=None):
 		self.prepare_to_open(fname, mode)
-		return open(self.get_fname(fname), mode)
+		return open_compressed(
+			self.get_fname(fname), mode, 
+			self.get_compression(fname, compress), self.threads
+		)
 
 
 	def __iter__(self):
+
+		# in incremental mode, only yield files not already consumed
+		if self.incremental:
+			self.files = [
+				os.path.abspath(self.get_fname(f)) for f in self.new_files()]
+			return self
+
 		# make a fresh list of all the files in the dir
 		files = [
 			os.path.abspath(os.path.join(self.get_path(), f))
 			for f in os.listdir(self.get_path()) 
 		]
-		self.files = [f for f in files if os.path.isfile(f)]
+		self.files = [
+			f for f in files 
+			if os.path.isfile(f) 
+			and os.path.basename(f) != self.manifest_fname
+		]
 		return self
 
 
@@ -319,7 +895,494 @@ class Folder(File):
 		return fname
 
 
-	#TODO: define exists
+	def get_manifest_path(self):
+		return os.path.join(self.get_path(), self.manifest_fname)
+
+
+	def remove_manifest(self):
+		# only one check per instance -- after that we know it's gone
+		if getattr(self, '_manifest_removed', False):
+			return
+
+		if os.path.isfile(self.get_manifest_path()):
+			os.remove(self.get_manifest_path())
+
+		self._manifest_removed = True
+
+
+	def write_manifest(self):
+		'''
+			Records the name and size of every file in the folder (and its
+			sha1 if `checksum` is set), marking the folder as complete.
+		'''
+
+		# an empty output folder is still a complete output folder
+		if not os.path.isdir(self.get_path()):
+			os.makedirs(self.get_path())
+
+		lines = []
+		for fname in sorted(os.listdir(self.get_path())):
+			if fname == self.manifest_fname:
+				continue
+
+			full_path = self.get_fname(fname)
+			if not os.path.isfile(full_path):
+				continue
+
+			fields = [fname, str(os.path.getsize(full_path))]
+			if self.checksum:
+				fields.append(checksum_file(full_path))
+
+			lines.append('\t'.join(fields) + '\n')
+
+		# write to a temporary name first, so a partially written manifest
+		# is never mistaken for a complete one
+		tmp_path = self.get_manifest_path() + '.tmp'
+		with open(tmp_path, 'w') as f:
+			f.writelines(lines)
+		os.rename(tmp_path, self.get_manifest_path())
+		self._manifest_removed = False
+
+
+	def read_manifest(self):
+		'''
+			Returns a list of `(fname, size, sha1)` tuples from the manifest.
+			`sha1` is None if checksums weren't recorded.
+		'''
+		entries = []
+		for line in open(self.get_manifest_path()):
+			fields = line.rstrip('\n').split('\t')
+			fname, size = fields[0], int(fields[1])
+			sha1 = fields[2] if len(fields) > 2 else None
+			entries.append((fname, size, sha1))
+
+		return entries
+
+
+	def verify(self, checksum=False):
+		'''
+			Checks that every file listed in the manifest is present with 
+			the recorded size.  If `checksum` is True, recorded checksums are
+			also recomputed and compared.
+		'''
+		if not self.exists():
+			return False
+
+		for fname, size, sha1 in self.read_manifest():
+			full_path = self.get_fname(fname)
+			try:
+				if os.path.getsize(full_path) != size:
+					return False
+			except OSError:
+				return False
+
+			if checksum and sha1 is not None:
+				if checksum_file(full_path) != sha1:
+					return False
+
+		return True
+
+
+	def read_ledger(self):
+		'''
+			Returns a dict mapping the name of each consumed file to the 
+			`(size, mtime)` it had when it was consumed.
+		'''
+		consumed = {}
+		if not self.ledger.exists():
+			return consumed
+
+		for line in self.ledger.open('r'):
+			fname, size, mtime = line.rstrip('\n').split('\t')
+			consumed[fname] = (size, mtime)
+
+		return consumed
+
+
+	def scan(self):
+		'''
+			Returns a dict mapping the name of each file in the folder to its
+			`(size, mtime)`, using one stat per file.
+		'''
+		# a folder that an upstream task hasn't made yet has no files
+		if not os.path.isdir(self.get_path()):
+			return {}
+
+		stats = {}
+		for fname in os.listdir(self.get_path()):
+			if fname == self.manifest_fname:
+				continue
+
+			info = os.stat(self.get_fname(fname))
+			if not stat.S_ISREG(info.st_mode):
+				continue
+
+			stats[fname] = (str(info.st_size), repr(info.st_mtime))
+
+		return stats
+
+
+	def find_new_files(self):
+		'''
+			Returns the folder's current `scan()`, and the names of the files
+			in it that were added or changed since the consuming task last
+			ran.
+		'''
+		stats = self.scan()
+		consumed = {} if self.get_clobber() else self.read_ledger()
+		new_files = sorted([
+			fname for fname, stat in stats.items()
+			if consumed.get(fname) != stat
+		])
+		return stats, new_files
+
+
+	def new_files(self):
+		'''
+			Lists the files that were added or changed since the consuming
+			task last ran.  The list is fixed the first time the task asks 
+			for it, so the ledger records exactly the files it was given.
+		'''
+		if self._new_files is None:
+			self._stats, self._new_files = self.find_new_files()
+
+		return self._new_files
+
+
+	def has_unconsumed(self):
+		if not self.incremental:
+			return False
+
+		# this is checked while scheduling, before upstream tasks have 
+		# filled the folder, so the listing isn't fixed yet
+		if self._new_files is not None:
+			return len(self._new_files) > 0
+
+		return len(self.find_new_files()[1]) > 0
+
+
+	def mark_consumed(self):
+		if not self.incremental or self._new_files is None:
+			return
+
+		consumed = {} if self.get_clobber() else self.read_ledger()
+		for fname in self._new_files:
+			consumed[fname] = self._stats[fname]
+
+		# rewrite the ledger under a temporary name, so an interruption 
+		# can't leave it truncated
+		lines = [
+			'%s\t%s\t%s\n' % (fname, size, mtime)
+			for fname, (size, mtime) in sorted(consumed.items())
+		]
+		tmp_path = self.ledger.get_path() + '.tmp'
+		if not os.path.isdir(self.ledger.get_dir()):
+			os.makedirs(self.ledger.get_dir())
+		with open(tmp_path, 'w') as f:
+			f.writelines(lines)
+		os.rename(tmp_path, self.ledger.get_path())
+
+		self._new_files = None
+
+
 	def exists(self):
-		pass
+		return os.path.isfile(self.get_manifest_path())
+
+
+	def get_files(self):
+		if not os.path.isdir(self.get_path()):
+			return []
+
+		paths = [self.get_fname(f) for f in os.listdir(self.get_path())]
+		return [p for p in paths if os.path.isfile(p)]
+
+
+	def checksum(self):
+		# a manifest with checksums already summarizes the folder's contents
+		if self.exists():
+			if all([sha1 is not None for f,s,sha1 in self.read_manifest()]):
+				return checksum_file(self.get_manifest_path())
+
+		return super(Folder, self).checksum()
+
+
+	def finalize(self):
+		self.write_manifest()
+
+
+	def commit(self):
+		if self.staged is None:
+			return
+
+		staged_path = self.get_path()
+		self.staged = None
+		path = self.get_path()
+		if not os.path.isdir(staged_path):
+			return
+
+		# a directory can't be renamed over another, so move the old one
+		# aside first
+		old_path = '%s.old-%d' % (path, os.getpid())
+		if os.path.isdir(path):
+			os.rename(path, old_path)
+		os.rename(staged_path, path)
+		if os.path.isdir(old_path):
+			shutil.rmtree(old_path)
+
+
+	def discard(self):
+		if self.staged is None:
+			return
+
+		if os.path.isdir(self.get_path()):
+			shutil.rmtree(self.get_path())
+		self.staged = None
+
+
+class PickleFile(File):
+	'''
+		A file holding one pickled python object, written with `dump(obj)` 
+		and read with `load()`, using the highest pickle protocol.
+	'''
+
+	@saves_args
+	def __init__(self, path, fname, **kwargs):
+		kwargs.setdefault('compress', False)
+		super(PickleFile, self).__init__(path, fname, **kwargs)
+
+
+	def dump(self, obj):
+		with self.open('wb') as f:
+			pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+
+
+	def load(self):
+		if self.broadcast:
+			return self.get_broadcast()
+		return self.load_pickle()
+
+
+	def load_broadcast(self):
+		# forked workers share the object's pages until they're written to,
+		# which includes reference counting, so only untouched pages stay
+		# shared
+		return self.load_pickle()
+
+
+	def load_pickle(self):
+		with open(self.get_path(), 'rb') as f:
+			return pickle.load(f)
+
+
+class ArrayFile(File):
+	'''
+		A file holding one numpy array in `.npy` format.  `load()` memory
+		maps the file read-only, so loading is nearly instantaneous and 
+		the data is paged in (and shared between processes) as it's used.
+		Requires numpy.
+	'''
+
+	@saves_args
+	def __init__(self, path, fname, **kwargs):
+		kwargs.setdefault('compress', False)
+		super(ArrayFile, self).__init__(path, fname, **kwargs)
+
+
+	def get_numpy(self):
+		try:
+			import numpy
+		except ImportError:
+			raise ResourceException('ArrayFile: numpy is required.')
+		return numpy
+
+
+	def dump(self, array):
+		numpy = self.get_numpy()
+		with self.open('wb') as f:
+			numpy.save(f, numpy.asanyarray(array), allow_pickle=False)
+
+
+	def load(self, mmap_mode='r'):
+		if self.broadcast and mmap_mode == 'r':
+			return self.get_broadcast()
+		return self.get_numpy().load(
+			self.get_path(), mmap_mode=mmap_mode, allow_pickle=False)
+
+
+	def load_broadcast(self):
+		return self.get_numpy().load(
+			self.get_path(), mmap_mode='r', allow_pickle=False)
+
+
+def estimate_size(obj, seen=None):
+	'''
+		Roughly estimates the memory used by `obj`, including the contents of
+		builtin containers, and the data of objects (e.g. numpy arrays) that
+		report their `nbytes`.
+	'''
+	if seen is None:
+		seen = set()
+	if id(obj) in seen:
+		return 0
+	seen.add(id(obj))
+
+	size = sys.getsizeof(obj)
+	nbytes = getattr(obj, 'nbytes', None)
+	if isinstance(nbytes, (int, long)):
+		size += nbytes
+
+	elif isinstance(obj, dict):
+		size += sum([
+			estimate_size(k, seen) + estimate_size(v, seen) 
+			for k, v in obj.iteritems()
+		])
+
+	elif isinstance(obj, (list, tuple, set, frozenset)):
+		size += sum([estimate_size(item, seen) for item in obj])
+
+	return size
+
+
+class MemoryStore(object):
+	'''
+		Holds the objects of MemoryResources in process memory, keyed by 
+		the resources' paths.  When holding an object would exceed `budget`
+		bytes, it is spilled to its pickle file instead.  Each object is
+		dropped once all of the tasks scheduled to consume it have finished.
+	'''
+
+	def __init__(self, budget=2**30):
+		self.budget = budget
+		self.objects = {}
+		self.sizes = {}
+		self.consumers = {}
+
+
+	def get_used(self):
+		return sum(self.sizes.values())
+
+
+	def has_room(self, size):
+		return self.budget is None or self.get_used() + size <= self.budget
+
+
+	def put(self, key, obj, size):
+		self.drop(key)
+		self.objects[key] = obj
+		self.sizes[key] = size
+
+
+	def drop(self, key):
+		self.objects.pop(key, None)
+		self.sizes.pop(key, None)
+
+
+	def add_consumer(self, key):
+		self.consumers[key] = self.consumers.get(key, 0) + 1
+
+
+	def release(self, key):
+		if key not in self.consumers:
+			return
+
+		self.consumers[key] -= 1
+		if self.consumers[key] <= 0:
+			del self.consumers[key]
+			self.drop(key)
+
+
+# the store shared by all MemoryResources in this process
+memory_store = MemoryStore()
+
+
+class MemoryResource(File):
+	'''
+		Holds an object produced by one task for downstream tasks in the 
+		same run, without writing it to disk.  The task calls `dump(obj)`,
+		and consumers call `load()`.  If keeping the object in memory would
+		exceed the budget of `memory_store`, it is pickled to the path of 
+		the resource (which is namespaced to the lot like a File) instead.
+		`spill()` does the same on demand, e.g. when the consumer will run
+		in another process.  Once every scheduled consumer has finished, the
+		object is dropped from memory.
+	'''
+
+	def get_key(self):
+		# the key doesn't change while the resource is staged
+		return os.path.abspath(self.get_final_path())
+
+
+	def exists(self):
+		return (
+			self.get_key() in memory_store.objects 
+			or os.path.isfile(self.get_path())
+		)
+
+
+	def is_spilled(self):
+		return os.path.isfile(self.get_path())
+
+
+	def get_files(self):
+		if self.is_spilled():
+			return [self.get_path()]
+		return None
+
+
+	def dump(self, obj):
+		# any earlier spilled copy is out of date
+		if self.is_spilled():
+			os.remove(self.get_path())
+
+		size = estimate_size(obj)
+		if memory_store.has_room(size):
+			memory_store.put(self.get_key(), obj, size)
+		else:
+			memory_store.drop(self.get_key())
+			self.write_pickle(obj)
+
+
+	def load(self):
+		try:
+			return memory_store.objects[self.get_key()]
+		except KeyError:
+			pass
+
+		if not self.is_spilled():
+			raise ResourceException(
+				'MemoryResource: there is no object in memory or on disk. '
+				+ self.get_path()
+			)
+
+		with open(self.get_path(), 'rb') as f:
+			return pickle.load(f)
+
+
+	def spill(self):
+		'''
+			Writes the object held in memory to disk, and frees the memory.
+		'''
+		key = self.get_key()
+		if key not in memory_store.objects:
+			return
+
+		self.write_pickle(memory_store.objects[key])
+		memory_store.drop(key)
+
+
+	def write_pickle(self, obj):
+		if not os.path.isdir(self.get_dir()):
+			os.makedirs(self.get_dir())
+
+		tmp_path = self.get_path() + '.tmp'
+		with open(tmp_path, 'wb') as f:
+			pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+		os.rename(tmp_path, self.get_path())
+
+
+	def register_consumer(self):
+		memory_store.add_consumer(self.get_key())
+
 
+	def release(self):
+		memory_store.release(self.get_key())
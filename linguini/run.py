@@ -1,6 +1,16 @@
+import os
 import sys
-from task import Task
-from resource import Resource, File
+import time
+import Queue
+import threading
+import traceback
+from task import Task, TaskException, ShardedTask, BatchTask
+from resource import Resource, File, broadcasts
+from state import RunState, checksum_files
+from stream import StreamPipe
+from pool import WorkerPool
+from lock import TaskLock
+from distributed import Coordinator
 
 def as_list(item):
 	if isinstance(item, dict):
@@ -24,6 +34,24 @@ class Runner(Task):
 	lot = None
 	outputs = None
 	inputs = None
+	cache = None
+	rebuild_stale = False
+	early_cutoff = False
+	checksum_threads = 4
+	state_path = './linguini_markers'
+	workers = 1
+	fuse = True
+	warm_workers = False
+	coordinate = False
+	lock_path = './linguini_markers'
+	lock_timeout = 60
+	heartbeat = 10
+	poll_interval = 1
+	address = None
+	speculate = False
+	speculation_factor = 2
+	speculation_min_siblings = 3
+	keep_going = False
 
 	def _tasks(self):
 		return self.tasks
@@ -97,8 +125,23 @@ class Runner(Task):
 			raise RunnerException(
 				'lot must be string-like (in %s).' % self.__class__.__name__)
 
-		# resolve tasks
-		self.tasks = self._tasks()
+		# resolve tasks (copied, since tasks can be added while running)
+		self.tasks = dict(self._tasks())
+
+		# sharded tasks are split into a task per shard, which take over the
+		# sharded task's dependencies.  The sharded task waits for them all.
+		for task_name in self.tasks.keys():
+			task_def = as_list(self.tasks[task_name])
+			if not isinstance(task_def[0], ShardedTask):
+				continue
+
+			shard_names = []
+			for shard in task_def[0].make_shards():
+				shard_name = '%s.shard%d' % (task_name, shard.index)
+				self.tasks[shard_name] = tuple([shard] + task_def[1:])
+				shard_names.append(shard_name)
+
+			self.tasks[task_name] = tuple([task_def[0]] + shard_names)
 
 		# get all the tasks ready
 		for task_name in self.tasks:
@@ -110,6 +153,12 @@ class Runner(Task):
 				clobber=self.get_clobber()
 			)
 
+		# index which tasks depend on each task
+		self.dependents = dict([(task_name, set()) for task_name in self.tasks])
+		for task_name in self.tasks:
+			for dependency in as_list(self.tasks[task_name])[1:]:
+				self.dependents.setdefault(dependency, set()).add(task_name)
+
 		# it isn't necessary to specify a run's outputs, because they are
 		# taken to be those of the END tasks
 		self.outputs = self.get_all_outputs()
@@ -126,6 +175,10 @@ class Runner(Task):
 
 			if self.clobber is True, then it schedules tasks even if already 
 			done.
+
+			if self.rebuild_stale is True, then done tasks are also scheduled
+			if their inputs are newer than their outputs, or if any of their
+			dependencies are scheduled.
 		'''
 
 		task_names = as_list(task_names)
@@ -136,26 +189,232 @@ class Runner(Task):
 
 		for task_name in reversed(task_names):
 
-			task_def = as_list(self.tasks[task_name])
-			task = task_def[0]
-			dependencies = task_def[1:]
+			# a task reached along several paths is only looked at once
+			if recurse and task_name in self.visited:
+				scheduled |= self.visited[task_name]
+				continue
+
+			task_scheduled = self.schedule_task(task_name, recurse)
+			if recurse:
+				self.visited[task_name] = task_scheduled
+			scheduled |= task_scheduled
+
+		return scheduled
+
+
+	def schedule_task(self, task_name, recurse=True):
+		'''
+			Returns the set of tasks to schedule for the named task (see
+			`recursively_schedule`).
+		'''
+		task_def = as_list(self.tasks[task_name])
+		task = task_def[0]
+		dependencies = task_def[1:]
+		scheduled = set()
+
+		if not task.exists() or task.get_clobber():
+
+			# add tasks to the schedule, without permitting duplicates
+			scheduled.add(task_name)
 
-			if not task.exists() or task.get_clobber():
+			# schedule dependant jobs, if any
+			if not recurse:
+				return scheduled
+			try:
+				scheduled |= (self.recursively_schedule(dependencies))
+			except KeyError:
+				pass
 
-				# add tasks to the schedule, without permitting duplicates
-				scheduled.add(task_name)
+		elif self.rebuild_stale and recurse:
 
-				# schedule dependant jobs, if any
-				if not recurse:
+			# a done task is rebuilt if it is outdated, or if anything
+			# upstream will be rebuilt
+			upstream = self.recursively_schedule(dependencies)
+			if self.is_stale(task):
+				self.reasons[task_name] = 'stale'
+			elif len(upstream) > 0:
+				self.reasons[task_name] = 'upstream'
+			else:
+				return scheduled
+
+			scheduled.add(task_name)
+			scheduled |= upstream
+
+		return scheduled
+
+
+	def get_dependents(self, task_names):
+		'''
+			Returns the names of all tasks that depend, directly or 
+			transitively, on any of the named tasks.
+		'''
+		found = set()
+		pending = list(as_list(task_names))
+		while len(pending) > 0:
+			for dependent in self.dependents.get(pending.pop(), []):
+				if dependent not in found:
+					found.add(dependent)
+					pending.append(dependent)
+
+		return found
+
+
+	def get_dependencies(self, task_name):
+		return as_list(self.tasks[task_name])[1:]
+
+
+	def may_have_children(self, task_name):
+		task = self.get_task(task_name)
+		return (
+			task.children.im_func is not Task.children.im_func
+			or task.reducer.im_func is not Task.reducer.im_func
+		)
+
+
+	def expand(self, task_name):
+		'''
+			Adds the children of a done task (and its reducer, if any) to the
+			runner's tasks, and schedules those that aren't done.  Children 
+			are named `<task_name>.<child_name>`, and the reducer
+			`<task_name>.reduce`.  Returns the names of the tasks scheduled.
+		'''
+		if task_name in self.expanded or not self.may_have_children(task_name):
+			return []
+		self.expanded.add(task_name)
+
+		task = self.get_task(task_name)
+		added = {}
+		for child_name, child in (task.children() or {}).items():
+			added['%s.%s' % (task_name, child_name)] = (child, task_name)
+
+		# the reducer runs even if there were no children
+		reducer = task.reducer()
+		if reducer is not None:
+			added['%s.reduce' % task_name] = tuple(
+				[reducer, task_name] + sorted(added))
+
+		if not added:
+			return []
+
+		# tasks that depend on this one wait for its children too
+		dependents = set(self.dependents.get(task_name, set()))
+		for dependent in dependents:
+			self.tasks[dependent] = tuple(
+				as_list(self.tasks[dependent]) + sorted(added))
+
+		# if this task was rebuilt, its children are rebuilt too
+		clobber = self.get_clobber() or task_name in self.reasons
+		scheduled = []
+		for name in sorted(added):
+			self.tasks[name] = added[name]
+			self.dependents[name] = set(dependents)
+			for dependency in added[name][1:]:
+				self.dependents[dependency].add(name)
+
+			child = added[name][0]
+			child.get_ready(self.get_lot(), self.get_pilot(), name, clobber)
+
+			# done children only need to rerun if this task's outputs change
+			if child.exists():
+				if task_name not in self.reasons:
 					continue
-				try:
-					scheduled |= (self.recursively_schedule(dependencies))
-				except KeyError:
-					pass
-				
+				self.reasons[name] = 'upstream'
+			self.schedule.add(name)
+			scheduled.append(name)
+
+		return scheduled
+
+
+	def get_upstream(self, task_names):
+		'''
+			Returns the named tasks, and all the tasks they depend on, 
+			directly or transitively.
+		'''
+		found = set()
+		pending = list(as_list(task_names))
+		while len(pending) > 0:
+			task_name = pending.pop()
+			if task_name in found:
+				continue
+			found.add(task_name)
+			pending.extend(as_list(self.tasks[task_name])[1:])
+
+		return found
+
+
+	def schedule_invalidated(self, task_names, until):
+		'''
+			Schedules the named tasks, even if they are done, along with the
+			tasks that depend on them (among those needed for `until`), and 
+			any not-done dependencies of these.  Other tasks are left alone.
+		'''
+		task_names = as_list(task_names)
+		for task_name in task_names:
+			if task_name not in self.tasks:
+				raise RunnerException(
+					'cannot invalidate %s: it is not defined in %s tasks'
+					% (task_name, self.__class__.__name__)
+				)
+
+		scheduled = set()
+		for task_name in task_names:
+			if task_name in self.skip:
+				continue
+			self.reasons[task_name] = 'invalidated'
+			scheduled.add(task_name)
+
+		targets = self.get_upstream(until)
+		for task_name in self.get_dependents(task_names):
+			if task_name not in targets or task_name in self.skip:
+				continue
+
+			# done dependents only need to rerun if something upstream 
+			# actually changes
+			task = self.get_task(task_name)
+			if task_name not in self.reasons and task.exists():
+				self.reasons[task_name] = 'upstream'
+			scheduled.add(task_name)
+
+		# anything these need that isn't done has to be scheduled too
+		for task_name in list(scheduled):
+			scheduled |= self.recursively_schedule(
+				as_list(self.tasks[task_name])[1:])
+
 		return scheduled
 
 
+	def get_mtime(self, path):
+		'''
+			Returns the mtime of `path`, stat-ing each path only once per run.
+		'''
+		try:
+			return self.mtimes[path]
+		except KeyError:
+			self.mtimes[path] = os.stat(path).st_mtime
+			return self.mtimes[path]
+
+
+	def is_stale(self, task):
+		'''
+			Indicates whether any of the task's inputs were modified after
+			the oldest of its outputs (or its marker) was written.
+		'''
+		input_mtimes = []
+		for input in task.get_all_inputs():
+			input_mtimes.extend(
+				[self.get_mtime(p) for p in (input.get_files() or [])])
+
+		output_mtimes = []
+		for output in task.get_all_outputs() + task.get_all_markers():
+			output_mtimes.extend(
+				[self.get_mtime(p) for p in (output.get_files() or [])])
+
+		if len(input_mtimes) == 0 or len(output_mtimes) == 0:
+			return False
+
+		return max(input_mtimes) > min(output_mtimes)
+
+
 	def check_schedule(self):
 
 		checked_tasks = set()
@@ -212,26 +471,989 @@ class Runner(Task):
 
 	def run_schedule(self):
 
+		if self.address is not None:
+			return self.run_distributed_schedule()
+
+		if self.workers > 1:
+			if self.coordinate:
+				raise RunnerException(
+					'Coordinated runners run their tasks serially; '
+					'start more runners instead of using workers.'
+				)
+			return self.run_parallel_schedule()
+
+		self.run_serial_schedule()
+		self.raise_failures(self.failures)
+
+
+	def run_serial_schedule(self):
+
 		# keep looping as long as their are incomplete tasks
 		while len(self.schedule)>0:
 
 			remaining = [t for t in self.schedule]
+			progress = False
 
 			# look at each task left in the schedule
 			for task_name in remaining:
 
-				# get the task definition
-				task_def = as_list(self.tasks[task_name])
-				task = task_def[0]
-				dependencies = task_def[1:]
+				# it may have been run already, streaming from another task
+				if task_name not in self.schedule:
+					continue
 
 				# if the task has scheduled dependencies, we can't run it yet
+				dependencies = as_list(self.tasks[task_name])[1:]
 				if any([d in self.schedule for d in dependencies]):
 					continue
 
-				# run the task, and remove it from the schedule
-				task._run()
+				if self.coordinate:
+					progress |= self.execute_claimed_task(task_name)
+					continue
+
+				# ready instances of a batch task are run together
+				try:
+					batch = self.get_batch(task_name)
+					if len(batch) > 1:
+						self.execute_batch(batch)
+					else:
+						self.execute_task(task_name)
+
+				# in keep_going mode, carry on with what doesn't depend on
+				# the failed task (workers leave that to the runner)
+				except Exception:
+					if not self.keep_going or getattr(self, 'in_worker', False):
+						raise
+					self.fail(self.current_task, traceback.format_exc())
+
+			# the ready tasks are all claimed by other runners, wait for them
+			if self.coordinate and not progress:
+				time.sleep(self.poll_interval)
+
+
+	def execute_claimed_task(self, task_name):
+		'''
+			Claims the task with a lock file before running it, so that 
+			runners sharing the lot never run the same task at once.  Returns
+			False if another runner holds the claim.
+		'''
+		lock = self.locks.get(task_name)
+		if lock is None:
+			lock_file = File(self.lock_path, '%s.lock' % task_name)
+			lock_file.get_ready(
+				self.get_lot(), self.get_pilot(), 'lock', False)
+			lock = TaskLock(
+				lock_file.get_path(), self.lock_timeout, self.heartbeat)
+			self.locks[task_name] = lock
+
+		if not lock.acquire():
+			self.claimed_elsewhere.add(task_name)
+			return False
+
+		try:
+			# another runner may have finished it.  (A task that was 
+			# scheduled despite existing, e.g. because it's stale or being
+			# clobbered, is only known to be done if we saw another runner 
+			# claim it.)
+			task = self.get_task(task_name)
+			clobber = self.get_clobber() or task.get_clobber()
+			if task.exists() and not clobber and (
+				task_name in self.claimed_elsewhere 
+				or (task_name not in self.existed 
+					and task_name not in self.reasons)
+			):
+				print '\tINFO: %s was run by another runner' % task_name
+				self.changed.add(task_name)
+				self.release_inputs(task)
 				self.schedule.remove(task_name)
+				self.expand(task_name)
+			else:
+				self.execute_task(task_name)
+
+		finally:
+			lock.release()
+
+		return True
+
+
+	def execute_task(self, task_name):
+		'''
+			Runs a scheduled task whose dependencies are done (or skips it, 
+			if it turns out to be up to date), and removes it from the 
+			schedule.
+		'''
+
+		task = self.get_task(task_name)
+		self.current_task = task_name
+		if self.skip_up_to_date(task_name):
+			return
+
+		# if a task can read this one's output as it's written, run 
+		# them together
+		consumer_name = self.find_stream_consumer(task_name)
+		if consumer_name is not None:
+			self.run_streamed(task_name, consumer_name)
+			return
+
+		# run the task, and remove it from the schedule
+		start = time.time()
+		self.run_task(task_name, task)
+		self.durations[task_name] = time.time() - start
+		self.finish_task(task_name, task)
+
+
+	def finish_task(self, task_name, task):
+		self.release_inputs(task)
+		self.schedule.remove(task_name)
+		self.expand_in_place(task_name)
+
+
+	def is_stopping(self, failures):
+		# after a failure, no more tasks are started, unless keep_going
+		return len(failures) > 0 and not self.keep_going
+
+
+	def fail(self, task_name, error):
+		print '\tERROR: %s failed' % task_name
+		self.failures.append({'name': task_name, 'error': error})
+		self.block(task_name)
+
+
+	def block(self, task_names):
+		'''
+			Removes the named tasks, and the scheduled tasks that depend on
+			them, from the schedule.
+		'''
+		task_names = set(as_list(task_names))
+		blocked = [
+			t for t in task_names | self.get_dependents(task_names)
+			if t in self.schedule
+		]
+		self.schedule -= set(blocked)
+		self.blocked |= set(blocked) - task_names
+
+
+	def skip_up_to_date(self, task_name):
+		'''
+			If the task was only scheduled because of its dependencies, and 
+			they turned out unchanged, it is already up to date.  Then it is
+			removed from the schedule, and True is returned.
+		'''
+		if not self.is_cut_off(task_name, self.get_dependencies(task_name)):
+			return False
+
+		print '\tINFO: %s is up to date' % task_name
+		task = self.get_task(task_name)
+		self.touch_outputs(task)
+		self.release_inputs(task)
+		self.schedule.remove(task_name)
+		self.expand_in_place(task_name)
+		return True
+
+
+	def get_batch(self, task_name):
+		'''
+			Returns the names of the ready, scheduled instances of the task's
+			class (up to its `batch_size`), if it's a BatchTask.
+		'''
+		task = self.get_task(task_name)
+		if not isinstance(task, BatchTask):
+			return [task_name]
+
+		batch = []
+		for other_name in sorted(self.schedule):
+			if self.get_task(other_name).__class__ is not task.__class__:
+				continue
+			dependencies = self.get_dependencies(other_name)
+			if any([d in self.schedule for d in dependencies]):
+				continue
+			batch.append(other_name)
+
+		return batch[:task.batch_size]
+
+
+	def execute_batch(self, task_names):
+		'''
+			Runs instances of a BatchTask with one call to `run_batch`, then 
+			has each instance save its result, and records them as done.
+			Instances that are up to date, or in the cache, are left out.
+		'''
+		batch = []
+		finished = []
+		previous = {}
+		for task_name in task_names:
+			self.current_task = task_name
+			if self.skip_up_to_date(task_name):
+				continue
+
+			task = self.get_task(task_name)
+			self.prepare_task(task_name, task)
+			previous[task_name] = self.get_previous_checksums(task_name, task)
+			if (
+				self.cache is not None and not task.get_clobber() 
+				and self.cache.restore(task)
+			):
+				print '\tINFO: restored %s from cache' % task_name
+				task._after()
+				finished.append(task_name)
+			else:
+				batch.append(task_name)
+
+		if len(batch) > 0:
+			self.current_task = batch[0]
+			start = time.time()
+			tasks = [self.get_task(t) for t in batch]
+
+			# outputs are staged, as when tasks run on their own
+			for task in tasks:
+				task.stage_outputs()
+
+			try:
+				results = tasks[0].run_batch([t.parameters for t in tasks])
+				if len(results) != len(tasks):
+					raise TaskException(
+						'run_batch() must return one result per parameter set.')
+
+				for task_name, task, result in zip(batch, tasks, results):
+					self.current_task = task_name
+					task.save(result)
+					task._after()
+					if self.cache is not None:
+						self.cache.store(task)
+					finished.append(task_name)
+
+			# the instances that were saved before the failure are done
+			except BaseException:
+				for task in tasks:
+					task.discard_outputs()
+				self.finish_batch(finished, previous)
+				raise
+
+			# the batch's time is shared by its tasks
+			for task_name in batch:
+				self.durations[task_name] = (time.time() - start) / len(batch)
+
+		self.finish_batch(finished, previous)
+
+
+	def finish_batch(self, task_names, previous):
+		for task_name in sorted(task_names):
+			task = self.get_task(task_name)
+			self.record_outputs(task_name, task, previous[task_name])
+			self.release_inputs(task)
+			self.schedule.remove(task_name)
+			self.expand_in_place(task_name)
+
+
+	def expand_in_place(self, task_name):
+		# workers leave it to the runner to add children to the schedule
+		if not getattr(self, 'in_worker', False):
+			self.expand(task_name)
+
+
+	def plan_units(self):
+		'''
+			Groups the scheduled tasks into units, each run back to back by 
+			one worker.  A task is fused with the next when that is its only
+			scheduled dependent, and it is that task's only scheduled 
+			dependency, so that linear chains become single units.
+		'''
+		successors = {}
+		for task_name in self.schedule:
+			if not self.fuse:
+				break
+
+			after = [
+				t for t in self.dependents.get(task_name, []) 
+				if t in self.schedule
+			]
+			if len(after) != 1 or self.may_have_children(task_name):
+				continue
+
+			before = set([
+				t for t in as_list(self.tasks[after[0]])[1:]
+				if t in self.schedule
+			])
+			if before == set([task_name]):
+				successors[task_name] = after[0]
+
+		units = []
+		heads = set(self.schedule) - set(successors.values())
+		for head in sorted(heads):
+			unit = [head]
+			while unit[-1] in successors:
+				unit.append(successors[unit[-1]])
+			units.append(unit)
+
+		return self.group_batches(units)
+
+
+	def group_batches(self, units):
+		'''
+			Puts instances of a BatchTask class that have the same scheduled 
+			dependencies, and would each be a unit of their own, into one 
+			unit (of up to `batch_size` tasks), to be run as a batch.
+		'''
+		batches = {}
+		grouped = []
+		for unit in units:
+			task = self.get_task(unit[0])
+			if len(unit) > 1 or not isinstance(task, BatchTask):
+				grouped.append(unit)
+				continue
+
+			dependencies = frozenset([
+				d for d in self.get_dependencies(unit[0]) if d in self.schedule
+			])
+			key = (task.__class__, dependencies)
+			batch = batches.get(key)
+			if batch is None or len(batch) == task.batch_size:
+				batch = batches[key] = []
+				grouped.append(batch)
+			batch.append(unit[0])
+
+		return grouped
+
+
+	def is_unit_ready(self, unit):
+		for task_name in unit:
+			for dependency in as_list(self.tasks[task_name])[1:]:
+				if dependency in self.schedule and dependency not in unit:
+					return False
+
+		return True
+
+
+	def get_initializers(self, unit):
+		'''
+			Lists the classes that define the `worker_init` of tasks in 
+			`unit`.  Subclasses share the initializer (and the state it loads)
+			of the class they inherit it from.
+		'''
+		initializers = set()
+		for task_name in unit:
+			for task_class in self.get_task(task_name).__class__.__mro__:
+				if task_class.__dict__.get('worker_init') is not None:
+					initializers.add(task_class)
+					break
+
+		return initializers
+
+
+	def serve(self, jobs, results):
+		'''
+			Runs in a worker process.  Runs the units it is sent, until it is
+			sent None.  Each task class's `worker_init` is called once per 
+			worker, before the first of its tasks is run.
+		'''
+		self.in_worker = True
+		initialized = set()
+		for unit, changed, stage in iter(jobs.get, None):
+			self.changed = set(changed)
+			self.run_unit(unit, results, initialized, stage)
+
+
+	def run_unit(self, unit, results, initialized, stage=None):
+		'''
+			Executes the unit's tasks in order, then reports back to the 
+			runner through the `results` queue.  If `stage` is given, the 
+			tasks' outputs are staged under that tag while the tasks run.
+		'''
+		self.recorded = {}
+		self.durations = {}
+		self.schedule = set(unit)
+		self.current_task = None
+		self.copy_tag = stage
+		report = {'unit': unit, 'pid': os.getpid()}
+
+		try:
+			for task_class in self.get_initializers(unit) - initialized:
+				task_class.worker_init()
+				initialized.add(task_class)
+
+			self.run_serial_schedule()
+
+			# anything held only in this process's memory would be lost
+			for task_name in unit:
+				for output in self.get_task(task_name).get_all_outputs():
+					output.spill()
+
+		except BaseException:
+			report['name'] = self.current_task
+			report['error'] = traceback.format_exc()
+
+		report['done'] = [t for t in unit if t not in self.schedule]
+		report['changed'] = [t for t in unit if t in self.changed]
+		report['checksums'] = self.recorded
+		report['durations'] = self.durations
+		results.put(report)
+
+
+	def load_broadcasts(self, unit, pending=()):
+		'''
+			Loads the broadcast inputs of tasks in `unit` in this process, so
+			that workers forked from now on share them.  Those at `pending`
+			paths are left, since they are about to be rewritten.
+		'''
+		for task_name in unit:
+			for input in self.get_task(task_name).get_all_inputs():
+				if not getattr(input, 'broadcast', False):
+					continue
+				if input.exists() and input.get_path() not in pending:
+					input.get_broadcast()
+
+
+	def get_pending_paths(self):
+		# the paths of the files that scheduled tasks will write
+		paths = set()
+		for task_name in self.schedule:
+			for output in self.get_task(task_name).get_all_outputs():
+				if isinstance(output, File):
+					paths.add(output.get_final_path())
+		return paths
+
+
+	def get_report(self, results, running, timeout=None):
+		'''
+			Waits for a worker to report back, or returns None after 
+			`timeout` seconds, if given.  If a worker dies without reporting,
+			a failure is reported on its behalf.
+		'''
+		poll = 0.5 if timeout is None else min(0.5, timeout)
+		give_up = None if timeout is None else time.time() + timeout
+		while True:
+			try:
+				return results.get(timeout=poll)
+			except Queue.Empty:
+				pass
+
+			for worker, unit in running.items():
+				if worker.is_alive():
+					continue
+
+				# it may have reported just before exiting
+				try:
+					return results.get(timeout=0.5)
+				except Queue.Empty:
+					return {
+						'unit': unit, 'done': [], 'changed': [], 
+						'checksums': {}, 'durations': {},
+						'pid': worker.process.pid, 'name': unit[0], 
+						'error': 'worker exited with code %s' % worker.exitcode
+					}
+
+			if give_up is not None and time.time() > give_up:
+				return None
+
+
+	def get_siblings(self, task_name):
+		'''
+			Lists the tasks of the same class as the named task, with the same
+			dependents (e.g. the shards of a ShardedTask).
+		'''
+		task_class = self.get_task(task_name).__class__
+		dependents = self.dependents.get(task_name, set())
+		return [
+			t for t in self.tasks if t != task_name 
+			and self.get_task(t).__class__ is task_class
+			and self.dependents.get(t, set()) == dependents
+		]
+
+
+	def is_straggling(self, unit, started):
+		'''
+			A unit of one task is straggling if it has been running for more 
+			than `speculation_factor` times the median duration of its 
+			siblings, once enough of them have finished.
+		'''
+		if len(unit) != 1:
+			return False
+
+		durations = sorted([
+			self.durations[t] for t in self.get_siblings(unit[0])
+			if t in self.durations
+		])
+		if len(durations) < self.speculation_min_siblings:
+			return False
+
+		median = durations[len(durations) / 2]
+		return time.time() - started > self.speculation_factor * median
+
+
+	def start_backups(self, pool, running, started, backups):
+		'''
+			Starts a backup copy of each straggling unit, if there are workers
+			to spare.  Both copies stage their outputs under their own tag,
+			and move them into place once done.
+		'''
+		for worker, unit in running.items():
+			# it may already have a backup
+			if running.values().count(unit) > 1:
+				continue
+			if not self.is_straggling(unit, started[worker]):
+				continue
+
+			initializers = self.get_initializers(unit)
+			backup = pool.get_worker(initializers)
+			if backup is None:
+				return
+
+			print '\tINFO: starting a backup copy of %s' % unit[0]
+			backup.submit((unit, self.changed, 'backup'), initializers)
+			running[backup] = unit
+			started[backup] = time.time()
+			backups.add(backup)
+
+
+	def settle_copies(self, report, pool, running, backups):
+		'''
+			Frees the worker that sent the report.  When a unit has a backup 
+			copy, the first copy to succeed wins, and the other is cancelled.
+			Returns False if the report should be ignored, because one copy 
+			failed while the other is still running.
+		'''
+		copies = [w for w, u in running.items() if u == report['unit']]
+		reporter = [w for w in copies if w.process.pid == report['pid']]
+
+		# a copy that was cancelled may have reported before it was killed
+		if len(reporter) == 0:
+			return False
+
+		reporter = reporter[0]
+		others = [w for w in copies if w is not reporter]
+		pool.release(reporter)
+		del running[reporter]
+		if 'error' in report and len(others) > 0:
+			self.discard_copy(report['unit'], reporter, backups)
+			return False
+
+		for worker in others:
+			print '\tINFO: cancelled a copy of %s' % report['unit'][0]
+			pool.discard(worker)
+			del running[worker]
+			self.discard_copy(report['unit'], worker, backups)
+
+		return True
+
+
+	def discard_copy(self, unit, worker, backups):
+		'''
+			Removes what a copy of a unit that won't finish staged, including
+			any checkpoints (the other copy is finishing the job).
+		'''
+		tag = 'backup' if worker in backups else 'primary'
+		for task_name in unit:
+			task = self.get_task(task_name)
+			for output in task.get_all_outputs():
+				output.stage(tag)
+				output.discard()
+			task.clear_checkpoint(tag)
+
+
+	def apply_report(self, report):
+		'''
+			Updates the runner with what a unit's worker did.  Returns units
+			for any children the unit's tasks added to the schedule.
+		'''
+		for task_name in report['done']:
+			self.schedule.discard(task_name)
+
+		self.changed |= set(report['changed'])
+		self.durations.update(report['durations'])
+		if self.early_cutoff:
+			for task_name, checksums in report['checksums'].items():
+				self.state.set(task_name, checksums)
+			self.state.save()
+
+		added = []
+		for task_name in report['done']:
+			added.extend(self.expand(task_name))
+
+		return [[task_name] for task_name in added]
+
+
+	def run_parallel_schedule(self):
+		'''
+			Runs the schedule using up to `self.workers` worker processes, 
+			each running one unit of fused tasks at a time.  If a task fails,
+			no more units are started, and once the running ones finish, a 
+			RunnerException describing the failure is raised.
+
+			With `warm_workers`, worker processes are kept for the whole run,
+			and units go to workers that already ran the `worker_init` of 
+			their task classes.
+		'''
+		units = self.plan_units()
+		pool = WorkerPool(self.workers, self.serve, self.warm_workers)
+		running = {}
+		started = {}
+		backups = set()
+		failures = self.failures
+		timeout = self.poll_interval if self.speculate else None
+
+		# a unit that may get a backup copy stages all its outputs, so the
+		# copies never write over each other
+		stage = 'primary' if self.speculate else None
+
+		# warm workers are only forked once, so they can only share the 
+		# broadcasts that are loaded before the first of them starts
+		if self.warm_workers:
+			pending = self.get_pending_paths()
+			for unit in units:
+				self.load_broadcasts(unit, pending)
+
+		try:
+			while len(units) > 0 or len(running) > 0:
+
+				# start units whose dependencies are done
+				for unit in list(units):
+					if self.is_stopping(failures):
+						break
+					if len(running) >= self.workers:
+						break
+					if not self.is_unit_ready(unit):
+						continue
+
+					self.load_broadcasts(unit)
+					initializers = self.get_initializers(unit)
+					worker = pool.get_worker(initializers)
+					if worker is None:
+						break
+
+					units.remove(unit)
+					worker.submit((unit, self.changed, stage), initializers)
+					running[worker] = unit
+					started[worker] = time.time()
+
+				# back up units taking much longer than their siblings
+				if self.speculate and not self.is_stopping(failures):
+					self.start_backups(pool, running, started, backups)
+
+				if len(running) == 0:
+					break
+
+				report = self.get_report(pool.results, running, timeout)
+				if report is None:
+					continue
+				if not self.settle_copies(report, pool, running, backups):
+					continue
+
+				units.extend(self.apply_report(report))
+				if 'error' in report:
+					failures.append(report)
+
+				# skip the failed task, and those depending on it.  Other 
+				# tasks of its unit that weren't done get another chance.
+				# (If no task was running, e.g. worker_init failed, the whole 
+				# unit is skipped.)
+				if 'error' in report and self.keep_going:
+					self.block(report['name'] or report['unit'])
+					units = [
+						[t for t in unit if t in self.schedule] 
+						for unit in units
+					]
+					units = [unit for unit in units if len(unit) > 0]
+					units.extend([
+						[t] for t in report['unit'] if t in self.schedule])
+
+		finally:
+			pool.close()
+
+		self.raise_failures(failures)
+
+
+	def run_distributed_schedule(self):
+		'''
+			Runs the schedule by handing tasks to workers that connect to
+			`self.address` over TCP (see `distributed.work`).
+		'''
+		self.raise_failures(Coordinator(self, self.address).run())
+
+
+	def raise_failures(self, failures):
+		if len(failures) == 0:
+			return
+
+		message = '\n'.join([
+			'task %s failed:\n%s' % (f['name'], f['error'])
+			for f in failures
+		])
+		if len(self.blocked) > 0:
+			message += '\ntasks not run because they depend on these: %s' % (
+				', '.join(sorted(self.blocked)))
+		raise RunnerException(message)
+
+
+	def register_consumers(self):
+		'''
+			Lets the inputs of scheduled tasks know they will be used, so 
+			that e.g. in-memory resources know when they can be dropped.
+		'''
+		for task_name in self.schedule:
+			for input in self.get_task(task_name).get_all_inputs():
+				input.register_consumer()
+
+
+	def release_inputs(self, task):
+		for input in task.get_all_inputs():
+			input.release()
+
+
+	def prepare_task(self, task_name, task):
+		# tasks being rebuilt need to overwrite their existing outputs
+		if task_name in self.reasons:
+			task.get_ready(
+				self.get_lot(), self.get_pilot(), task_name, clobber=True)
+
+
+	def match_stream(self, producer, consumer):
+		'''
+			Returns the producer's output and the consumer's input that are 
+			the same File, if the consumer reads it as a stream, or None.
+		'''
+		outputs = dict([
+			(o.get_path(), o) for o in producer.get_all_outputs()
+			if isinstance(o, File)
+		])
+		for input in consumer.get_all_inputs():
+			if not isinstance(input, File) or not input.stream:
+				continue
+			if input.get_path() in outputs:
+				return outputs[input.get_path()], input
+
+		return None
+
+
+	def find_stream_consumer(self, task_name):
+		'''
+			Finds a scheduled task that can run at the same time as this 
+			one, reading its output through a pipe: it streams one of this 
+			task's File outputs, and this task is the last of its scheduled
+			dependencies.  Returns its name, or None.
+		'''
+		producer = self.get_task(task_name)
+		if self.cache is not None or isinstance(producer, Runner):
+			return None
+
+		# the consumer would run without being claimed
+		if self.coordinate:
+			return None
+
+		for consumer_name in sorted(self.dependents.get(task_name, [])):
+			if consumer_name not in self.schedule:
+				continue
+
+			consumer = self.get_task(consumer_name)
+			if isinstance(consumer, Runner):
+				continue
+
+			# the consumer might turn out not to need running at all
+			if self.early_cutoff and (
+				self.reasons.get(consumer_name) == 'upstream'
+			):
+				continue
+
+			dependencies = as_list(self.tasks[consumer_name])[1:]
+			others = [d for d in dependencies if d != task_name]
+			if any([d in self.schedule for d in others]):
+				continue
+
+			match = self.match_stream(producer, consumer)
+			if match is None:
+				continue
+
+			# an output that isn't written to disk can only have one reader
+			output, input = match
+			if not output.persist and self.count_readers(output) > 1:
+				continue
+
+			return consumer_name
+
+		return None
+
+
+	def count_readers(self, resource):
+		path = resource.get_path()
+		readers = 0
+		for task_name in self.schedule:
+			for input in self.get_task(task_name).get_all_inputs():
+				if isinstance(input, File) and input.get_path() == path:
+					readers += 1
+
+		return readers
+
+
+	def run_streamed(self, producer_name, consumer_name):
+		'''
+			Runs the producer in a thread and the consumer in this one, with
+			what the producer writes to its output piped straight into the
+			consumer's reads of its input.
+		'''
+		print '\tINFO: streaming %s into %s' % (producer_name, consumer_name)
+		producer = self.get_task(producer_name)
+		consumer = self.get_task(consumer_name)
+		self.prepare_task(producer_name, producer)
+		self.prepare_task(consumer_name, consumer)
+		previous = [
+			self.get_previous_checksums(producer_name, producer),
+			self.get_previous_checksums(consumer_name, consumer)
+		]
+
+		output, input = self.match_stream(producer, consumer)
+		pipe = StreamPipe()
+		output.pipe = input.pipe = pipe
+
+		errors = []
+		def produce():
+			try:
+				producer._run()
+			except BaseException:
+				errors.append(sys.exc_info())
+			finally:
+				pipe.close_writer()
+
+		# the consumer's outputs are staged, as when it runs on its own
+		start = time.time()
+		consumer.stage_outputs()
+		consumer_errors = []
+		thread = threading.Thread(target=produce)
+		thread.start()
+		self.current_task = consumer_name
+		try:
+			consumer.run()
+
+		except BaseException:
+			consumer.discard_outputs()
+			consumer_errors.append(sys.exc_info())
+
+		# even if the consumer stopped reading, let the producer finish
+		finally:
+			pipe.drain()
+			thread.join()
+			output.pipe = input.pipe = None
+
+		# if the producer failed, the consumer read a truncated stream, and
+		# its outputs (and any checkpoint) can't be trusted
+		if len(errors) > 0:
+			self.current_task = producer_name
+			consumer.clear_checkpoint()
+			for resource in consumer.get_all_outputs():
+				if getattr(resource, 'staged', None) is None:
+					for path in (resource.get_files() or []):
+						os.remove(path)
+			consumer.discard_outputs()
+			exc_type, exc_value, exc_traceback = errors[0]
+			raise exc_type, exc_value, exc_traceback
+
+		# otherwise the producer is done, even if the consumer failed
+		self.record_outputs(producer_name, producer, previous[0])
+		self.durations[producer_name] = time.time() - start
+		self.finish_task(producer_name, producer)
+		if len(consumer_errors) > 0:
+			exc_type, exc_value, exc_traceback = consumer_errors[0]
+			raise exc_type, exc_value, exc_traceback
+
+		consumer._after()
+		self.record_outputs(consumer_name, consumer, previous[1])
+		self.durations[consumer_name] = time.time() - start
+		self.finish_task(consumer_name, consumer)
+
+
+	def run_task(self, task_name, task):
+		'''
+			Runs one task.  If an output cache is in use, the task's outputs
+			are restored from the cache when possible (unless clobbering), 
+			and stored in the cache after it runs.
+		'''
+		self.prepare_task(task_name, task)
+
+		previous = self.get_previous_checksums(task_name, task)
+
+		# a unit that may be run by two copies stages all of its outputs 
+		# (not just atomic ones), so they never write in the same place
+		stage = getattr(self, 'copy_tag', None)
+		if stage is not None:
+			task.stage_tag = stage
+			task.stage_outputs(every=True)
+
+		if self.cache is None:
+			task._run()
+
+		elif not task.get_clobber() and self.cache.restore(task):
+			print '\tINFO: restored %s from cache' % task_name
+			task._after()
+
+		else:
+			task._run()
+			self.cache.store(task)
+
+		self.record_outputs(task_name, task, previous)
+
+
+	def checksum_outputs(self, task):
+		paths = []
+		for output in task.get_all_outputs():
+			paths.extend(output.get_files() or [])
+
+		return dict(zip(paths, checksum_files(paths, self.checksum_threads)))
+
+
+	def get_previous_checksums(self, task_name, task):
+		'''
+			Returns the checksums of the task's outputs from when it last ran.
+			If they weren't recorded, the outputs currently in place (if 
+			any) are checksummed before they are overwritten.
+		'''
+		if not self.early_cutoff:
+			return None
+
+		previous = self.state.get(task_name)
+		if previous is None:
+			previous = self.checksum_outputs(task)
+
+		return previous
+
+
+	def record_outputs(self, task_name, task, previous):
+		'''
+			Notes whether the task's outputs changed by running it.  In 
+			early_cutoff mode they are compared by checksum with the previous
+			outputs, which are then replaced in the per-lot state file.
+		'''
+		if not self.early_cutoff:
+			self.changed.add(task_name)
+			return
+
+		checksums = self.checksum_outputs(task)
+		if len(checksums) == 0 or checksums != previous:
+			self.changed.add(task_name)
+
+		# workers report checksums back, and the runner saves them, so that
+		# workers don't overwrite each other's state
+		self.state.set(task_name, checksums)
+		if getattr(self, 'in_worker', False):
+			self.recorded[task_name] = checksums
+		else:
+			self.state.save()
+
+
+	def is_cut_off(self, task_name, dependencies):
+		if not self.early_cutoff:
+			return False
+
+		if self.reasons.get(task_name) != 'upstream':
+			return False
+
+		return not any([d in self.changed for d in dependencies])
+
+
+	def touch_outputs(self, task):
+		'''
+			Updates the mtimes of a task's outputs and markers, so that 
+			tasks skipped by early cutoff don't look stale later.
+		'''
+		for resource in task.get_all_outputs() + task.get_all_markers():
+			for path in (resource.get_files() or []):
+				os.utime(path, None)
 
 
 	def _run(
@@ -258,11 +1480,72 @@ class Runner(Task):
 			clobber=False,
 			share=False,
 			skip=[],
-			just=None
+			just=None,
+			cache=None,
+			rebuild_stale=None,
+			early_cutoff=None,
+			invalidate=None,
+			workers=None,
+			warm_workers=None,
+			coordinate=None,
+			address=None,
+			speculate=None,
+			keep_going=None
 		):
 
 		self.share = share
 
+		# an OutputCache passed to run overrides the one on the class
+		if cache is not None:
+			self.cache = cache
+
+		# in rebuild_stale mode, tasks with outdated outputs are rerun
+		if rebuild_stale is not None:
+			self.rebuild_stale = rebuild_stale
+		self.mtimes = {}
+
+		# what scheduling each task added, so each is only looked at once
+		self.visited = {}
+
+		# records why tasks that are already done were scheduled
+		self.reasons = {}
+
+		# in early_cutoff mode, tasks whose dependencies were rebuilt 
+		# without changing their outputs are skipped
+		if early_cutoff is not None:
+			self.early_cutoff = early_cutoff
+		self.changed = set()
+		self.durations = {}
+
+		# with more than one worker, tasks run in parallel processes
+		if workers is not None:
+			self.workers = workers
+		if warm_workers is not None:
+			self.warm_workers = warm_workers
+
+		# coordinated runners claim tasks with lock files, so that several
+		# can work through one lot together
+		if coordinate is not None:
+			self.coordinate = coordinate
+		self.locks = {}
+		self.claimed_elsewhere = set()
+		self.existed = set()
+
+		# with an address, tasks are run by workers connecting over TCP
+		if address is not None:
+			self.address = address
+
+		# in parallel runs, straggling tasks can be backed up
+		if speculate is not None:
+			self.speculate = speculate
+
+		# in keep_going mode, a failed task only stops the tasks that depend
+		# on it.  The failures are raised together at the end.
+		if keep_going is not None:
+			self.keep_going = keep_going
+		self.failures = []
+		self.blocked = set()
+
 		self.just = just
 		if self.just is not None:
 			print 'Only doing', self.just
@@ -311,9 +1594,39 @@ class Runner(Task):
 		else:
 			self.schedule = self.recursively_schedule(until)
 
+		# invalidated tasks and their dependents are rerun, even if done
+		if invalidate is not None:
+			self.schedule |= self.schedule_invalidated(invalidate, until)
+
+		# tasks that are already done may have children left to do
+		self.expanded = set()
+		if self.just is None:
+			for task_name in sorted(self.get_upstream(until)):
+				if task_name not in self.schedule:
+					self.expand(task_name)
+
 		print '\t*** THE FOLLOWING TASKS WERE SCHEDULED', self.schedule
 
+		# coordinated runners note which scheduled tasks were already done, 
+		# so they aren't mistaken for tasks another runner did
+		if self.coordinate:
+			self.existed = set([
+				t for t in self.schedule if self.get_task(t).exists()])
+
+		# load the checksums recorded for this lot
+		if self.early_cutoff:
+			state_file = File(self.state_path, 'linguini.state')
+			state_file.get_ready(
+				self.get_lot(), self.get_pilot(), 'state', False)
+			self.state = RunState(state_file.get_path())
+
 		# run the tasks
-		self.run_schedule()
+		self.register_consumers()
+		try:
+			self.run_schedule()
+
+		# free what was loaded for broadcast
+		finally:
+			broadcasts.clear()
 
 
@@ -0,0 +1,66 @@
+import os
+from multiprocessing.pool import ThreadPool
+from resource import checksum_file
+
+
+def checksum_files(paths, threads=4):
+	'''
+		Returns the sha1 digests of the files at `paths`, in order.  The
+		files are hashed by a pool of threads, which run in parallel because
+		hashlib releases the GIL while digesting large blocks.
+	'''
+	if len(paths) < 2 or threads < 2:
+		return [checksum_file(p) for p in paths]
+
+	pool = ThreadPool(min(threads, len(paths)))
+	try:
+		return pool.map(checksum_file, paths)
+	finally:
+		pool.close()
+		pool.join()
+
+
+class RunState(object):
+	'''
+		Records, for each task, the sha1 of each of its output files the
+		last time it ran.  The state is kept in a text file with one
+		`task_name<TAB>path<TAB>sha1` line per output file.
+	'''
+
+	def __init__(self, path):
+		self.path = path
+		self.checksums = {}
+		if os.path.isfile(path):
+			self.load()
+
+
+	def load(self):
+		self.checksums = {}
+		for line in open(self.path):
+			task_name, path, sha1 = line.rstrip('\n').split('\t')
+			self.checksums.setdefault(task_name, {})[path] = sha1
+
+
+	def save(self):
+		lines = []
+		for task_name in sorted(self.checksums):
+			for path, sha1 in sorted(self.checksums[task_name].items()):
+				lines.append('%s\t%s\t%s\n' % (task_name, path, sha1))
+
+		# write under a temporary name first, so an interruption can't
+		# leave the state truncated
+		state_dir = os.path.dirname(self.path)
+		if state_dir and not os.path.isdir(state_dir):
+			os.makedirs(state_dir)
+		tmp_path = self.path + '.tmp'
+		with open(tmp_path, 'w') as f:
+			f.writelines(lines)
+		os.rename(tmp_path, self.path)
+
+
+	def get(self, task_name):
+		return self.checksums.get(task_name)
+
+
+	def set(self, task_name, checksums):
+		self.checksums[task_name] = checksums
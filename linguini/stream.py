@@ -0,0 +1,127 @@
+import os
+
+
+class StreamPipe(object):
+	'''
+		An OS pipe connecting a task that writes a File to a task that reads
+		it at the same time.  The pipe's buffer is bounded by the OS, so a
+		writer that gets ahead of its reader simply blocks.
+	'''
+
+	def __init__(self):
+		read_fd, write_fd = os.pipe()
+		self.reader = PipeReader(os.fdopen(read_fd, 'rb'))
+		self.writer = os.fdopen(write_fd, 'wb')
+
+
+	def close_writer(self):
+		# the reader sees the end of the stream once the writer is closed
+		if not self.writer.closed:
+			self.writer.close()
+
+
+	def drain(self, block_size=2**16):
+		'''
+			Reads and discards whatever the reader didn't consume, so that
+			the writer is never left blocked, then closes the reader.
+		'''
+		if self.reader.closed:
+			return
+
+		while self.reader.read(block_size):
+			pass
+		self.reader.fh.close()
+
+
+class PipeReader(object):
+	'''
+		Wraps the reading end of a pipe.  Iterating over a python 2 file 
+		reads ahead until its buffer is full, which would hold up lines the
+		writer has already sent, so lines are read one at a time instead.
+	'''
+
+	def __init__(self, fh):
+		self.fh = fh
+
+
+	def read(self, size=-1):
+		return self.fh.read(size)
+
+
+	def readline(self):
+		return self.fh.readline()
+
+
+	def readlines(self):
+		return list(self)
+
+
+	def __iter__(self):
+		return iter(self.fh.readline, '')
+
+
+	@property
+	def closed(self):
+		return self.fh.closed
+
+
+	def close(self):
+		# the pipe is closed by the runner once it's drained, so that a 
+		# reader that stops early doesn't break the writer
+		pass
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+
+class TeeWriter(object):
+	'''
+		A writable file-like object that sends everything written to it into
+		a StreamPipe, and also to `fh` if it isn't None.  Closing it closes
+		`fh`, but the pipe stays open until the writing task has finished.
+	'''
+
+	def __init__(self, pipe, fh=None):
+		self.pipe = pipe
+		self.fh = fh
+		self.closed = False
+
+
+	def write(self, data):
+		self.pipe.writer.write(data)
+		if self.fh is not None:
+			self.fh.write(data)
+
+
+	def writelines(self, lines):
+		for line in lines:
+			self.write(line)
+
+
+	def flush(self):
+		self.pipe.writer.flush()
+		if self.fh is not None:
+			self.fh.flush()
+
+
+	def close(self):
+		if self.closed:
+			return
+		if not self.pipe.writer.closed:
+			self.pipe.writer.flush()
+		if self.fh is not None:
+			self.fh.close()
+		self.closed = True
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
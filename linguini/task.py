@@ -1,5 +1,10 @@
+import os
+try:
+	import cPickle as pickle
+except ImportError:
+	import pickle
 from utils import copy, saves_args
-from resource import Resource, MarkerResource
+from resource import Resource, MarkerResource, File
 
 class TaskException(Exception):
 	pass
@@ -10,6 +15,17 @@ class Task(Resource):
 	inputs = None
 	outputs = None
 
+	# a classmethod that loads state shared by all tasks of the class (e.g.
+	# a model).  When running with warm workers, it's called once per worker
+	worker_init = None
+
+	# where checkpoints are kept (tasks with markers keep them by the marker)
+	checkpoint_path = './linguini_markers'
+
+	# outputs are staged under this tag while the task runs (the runner
+	# gives copies of a task their own)
+	stage_tag = 'partial'
+
 	@saves_args
 	def __init__(self, **kwargs):
 		
@@ -42,13 +58,18 @@ class Task(Resource):
 		self.inputs = copy(self._inputs())
 		for input in self.get_all_inputs():
 			input.get_ready(
-				self.get_lot(), self.get_pilot(), 'poop', self.get_clobber())
+				self.get_lot(), self.get_pilot(), self.name, self.get_clobber())
 
 		# Ready the outputs 
 		self.outputs = copy(self._outputs())
 		for output in self.get_all_outputs():
 			output.get_ready(
-				self.get_lot(), self.get_pilot(), 'poop', self.get_clobber())
+				self.get_lot(), self.get_pilot(), self.name, self.get_clobber())
+
+		self.checkpoint_file = File(
+			self.get_checkpoint_dir(), self.name + '.checkpoint')
+		self.checkpoint_file.get_ready(
+			self.get_lot(), self.get_pilot(), self.name, self.get_clobber())
 
 
 	def get_all_inputs(self):
@@ -100,12 +121,28 @@ class Task(Resource):
 	def exists(self):
 		'''
 			Indicates whether this Task is complete.  It's considered
-			complete if all of its outputs `exist`.
+			complete if all of its outputs `exist`, and none of its inputs
+			hold data it hasn't consumed yet.
 		'''
 
+		if self.has_unconsumed_inputs():
+			return False
+
 		return all([o.exists() for o in self.get_all_outputs()])
 
 
+	def get_all_markers(self):
+		'''
+			Lists the resources, other than outputs, that record whether
+			this task is complete.
+		'''
+		return []
+
+
+	def has_unconsumed_inputs(self):
+		return any([i.has_unconsumed() for i in self.get_all_inputs()])
+
+
 	def _outputs(self):
 		return self.outputs
 
@@ -115,8 +152,49 @@ class Task(Resource):
 
 
 	def _run(self, lot=None, pilot=False):
-		return_val = self.run()
+
+		# outputs are written under temporary names, and only moved into 
+		# place if the task succeeds
+		self.stage_outputs()
+
+		try:
+			return_val = self.run()
+		except BaseException:
+			self.discard_outputs()
+			raise
+
 		self._after()
+
+
+	def stage_outputs(self, every=False):
+		'''
+			Stages the task's atomic outputs (or `every` output) under its 
+			`stage_tag`.  Whatever an earlier attempt left staged under the
+			tag is kept if it left a checkpoint to resume from, and removed
+			otherwise.
+		'''
+		# a task rerun from scratch can't resume
+		if self.get_clobber():
+			self.clear_checkpoint()
+
+		resuming = self.has_checkpoint()
+		for output in self.get_all_outputs():
+			if not (every or getattr(output, 'atomic', False)):
+				continue
+
+			output.stage(self.stage_tag)
+			if not resuming:
+				output.discard()
+				output.stage(self.stage_tag)
+
+
+	def discard_outputs(self):
+		# a task that checkpointed resumes into what it staged
+		if self.has_checkpoint():
+			return
+
+		for output in self.get_all_outputs():
+			output.discard()
 		
 
 	def run(self):
@@ -124,9 +202,96 @@ class Task(Resource):
 
 
 	def _after(self):
+		# let the outputs record that they are complete, and move them
+		# into place
+		for output in self.get_all_outputs():
+			output.finalize()
+			output.commit()
+
+		# and let incremental inputs record what was consumed
+		for input in self.get_all_inputs():
+			input.mark_consumed()
+
+		# once the task is marked done, its checkpoint isn't needed
+		self.mark_done()
+		self.clear_checkpoint()
+
+
+	def mark_done(self):
 		pass
 
 
+	def get_checkpoint_dir(self):
+		return self.checkpoint_path
+
+
+	def get_checkpoint_path(self, tag=None):
+		# a checkpoint belongs with the outputs staged under the same tag
+		return '%s.%s' % (
+			self.checkpoint_file.get_path(), tag or self.stage_tag)
+
+
+	def has_checkpoint(self):
+		return os.path.isfile(self.get_checkpoint_path())
+
+
+	def checkpoint(self, state):
+		'''
+			Saves `state` (anything picklable), so that if the task is 
+			interrupted, the next attempt can pick up from it with 
+			`restore()`.  Outputs are staged while the task runs, and if it
+			fails after checkpointing, what it staged is kept, so the next
+			attempt resumes writing them where this one left off.
+
+			The checkpoint is replaced atomically, so an interruption while
+			saving leaves the previous one.
+		'''
+		path = self.get_checkpoint_path()
+		if not os.path.isdir(os.path.dirname(path)):
+			os.makedirs(os.path.dirname(path))
+
+		tmp_path = '%s.tmp-%d' % (path, os.getpid())
+		with open(tmp_path, 'wb') as f:
+			pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+		os.rename(tmp_path, path)
+
+
+	def restore(self, default=None):
+		'''
+			Returns the state saved by the last `checkpoint()` of an attempt
+			that didn't finish, or `default` if there is none.
+		'''
+		if not self.has_checkpoint():
+			return default
+
+		print '\tINFO: %s is resuming from a checkpoint' % self.name
+		with open(self.get_checkpoint_path(), 'rb') as f:
+			return pickle.load(f)
+
+
+	def clear_checkpoint(self, tag=None):
+		if os.path.isfile(self.get_checkpoint_path(tag)):
+			os.remove(self.get_checkpoint_path(tag))
+
+
+	def children(self):
+		'''
+			Called by the runner once the task is done.  Returns a dict of 
+			tasks to add to the schedule, keyed by name (e.g. one per file 
+			the task wrote).  The children depend on this task, and tasks 
+			that depend on this task wait for the children too.
+		'''
+		return {}
+
+
+	def reducer(self):
+		'''
+			Returns a task to run once all of this task's children are done,
+			or None.
+		'''
+		return None
+
+
 	def __hash__(self):
 		return hash((self.__class__.__name__, self._hashable_parameters))
 
@@ -137,25 +302,165 @@ class MarkedTask(Task):
 	def get_ready(self, lot, pilot, name, clobber=False):
 		super(MarkedTask, self).get_ready(lot, pilot, name, clobber)
 
+		fname = self.name + '.marker'
+		self.marker = MarkerResource(self.get_marker_dir(), fname)
+		self.marker.get_ready(lot, pilot, name, clobber)
+
+
+	def get_marker_dir(self):
 		try:
-			path = self.marker_path
+			return self.marker_path
 		except AttributeError:
-			path = '.'
+			return '.'
 
-		fname = self.name + '.marker'
-		self.marker = MarkerResource(path, fname)
-		self.marker.get_ready(lot, pilot, name, clobber)
+
+	def get_checkpoint_dir(self):
+		return self.get_marker_dir()
 
 
 	def exists(self):
+		if self.has_unconsumed_inputs():
+			return False
+
 		return self.marker.exists()
 
 
-	def _after(self):
-		super(MarkedTask, self)._after()
+	def get_all_markers(self):
+		return [self.marker]
+
+
+	def mark_done(self):
 		self.marker.mark()
 
 
 class SimpleTask(MarkedTask):
 	outputs = None
 	marker_path = './linguini_markers'
+
+
+class ShardedTask(MarkedTask):
+	'''
+		A task done in `shards` independent parts by `run_shard(i)`, and 
+		then combined by `reduce()`.  The runner schedules each shard as its
+		own task, named `<name>.shard<i>` and with its own marker under 
+		`marker_path`, so shards can run in parallel, and after a failure 
+		only the shards that weren't marked done are rerun.  The sharded 
+		task itself depends on its shards, runs `reduce()`, and is marked
+		done in turn.
+
+		Files written by a shard should be declared by `shard_outputs(i)`,
+		so that they are staged and moved into place like any task's 
+		outputs.  `run_shard` and `reduce` get them, readied, from 
+		`get_shard_outputs(i)`.
+	'''
+
+	shards = 1
+	marker_path = './linguini_markers'
+
+	@saves_args
+	def __init__(self, **kwargs):
+		self.shard_tasks = {}
+		super(ShardedTask, self).__init__(**kwargs)
+
+
+	def get_shards(self):
+		return self.parameters.get('shards', self.shards)
+
+
+	def make_shards(self):
+		return [Shard(self, i) for i in range(self.get_shards())]
+
+
+	def run(self):
+		self.reduce()
+
+
+	def shard_outputs(self, i):
+		return None
+
+
+	def get_shard_outputs(self, i):
+		# shards register themselves when readied.  Where they weren't 
+		# (e.g. on a distributed worker running the reduce), make them.
+		if i not in self.shard_tasks:
+			shard = Shard(self, i)
+			shard.get_ready(
+				self.get_lot(), self.get_pilot(), '%s.shard%d' % (self.name, i))
+
+		return self.shard_tasks[i].outputs
+
+
+	def run_shard(self, i):
+		raise NotImplementedError('You need to define run_shard().')
+
+
+	def reduce(self):
+		pass
+
+
+class Shard(MarkedTask):
+	'''
+		One shard of a ShardedTask.  It reads the sharded task's inputs, and
+		writes the outputs given by its `shard_outputs`, but is complete once
+		its marker is written.
+	'''
+
+	@saves_args
+	def __init__(self, sharded_task, index):
+		self.sharded_task = sharded_task
+		self.index = index
+		self.marker_path = sharded_task.marker_path
+
+		# shards of different sharded tasks are different tasks (e.g. to
+		# the output cache)
+		super(Shard, self).__init__(
+			index=index,
+			sharded_class='%s.%s' % (
+				sharded_task.__class__.__module__, 
+				sharded_task.__class__.__name__
+			),
+			sharded_parameters=sharded_task._hashable_parameters
+		)
+
+
+	def get_ready(self, lot, pilot, name, clobber=False):
+		super(Shard, self).get_ready(lot, pilot, name, clobber)
+		self.sharded_task.shard_tasks[self.index] = self
+
+
+	def _inputs(self):
+		return self.sharded_task._inputs()
+
+
+	def _outputs(self):
+		return self.sharded_task.shard_outputs(self.index)
+
+
+	def run(self):
+		self.sharded_task.run_shard(self.index)
+
+
+class BatchTask(Task):
+	'''
+		A task whose instances, differing only in their parameters, can be
+		run together, so that setup (e.g. loading data) is done once per 
+		batch.  The runner groups ready instances of the same class (up to 
+		`batch_size` at a time), and calls `run_batch` on one of them with
+		the parameters of each, in order.  It must return one result per 
+		parameter set, which is passed to the `save` method of the matching
+		instance, to write that instance's outputs.  Each instance is then 
+		finished (outputs finalized, marker written) as usual.
+	'''
+
+	batch_size = None
+
+	def run(self):
+		self.save(self.run_batch([self.parameters])[0])
+
+
+	def run_batch(self, parameter_sets):
+		raise NotImplementedError('You need to define run_batch().')
+
+
+	def save(self, result):
+		raise NotImplementedError('You need to define save().')
@@ -1,9 +1,29 @@
+import gzip
+import pickle
+import re
 import shutil
+import socket
+import threading
+import time
+import multiprocessing
+try:
+	import numpy
+except ImportError:
+	numpy = None
 import unittest
 from unittest import TestCase
 from run import Runner, RunnerException
-from task import Task, TaskException, MarkedTask, SimpleTask
-from resource import Resource, File, Folder
+from task import (
+	Task, TaskException, MarkedTask, SimpleTask, ShardedTask, BatchTask
+)
+from resource import (
+	Resource, ResourceException, File, Folder, IncrementalFile, 
+	MemoryResource, memory_store, PickleFile, ArrayFile
+)
+from compression import ParallelGzipWriter
+from cache import OutputCache
+from lock import TaskLock
+from distributed import work
 import os
 
 
@@ -16,6 +36,10 @@ def touch(fname):
 	open(fname, 'a').close()
 
 
+def count_lines(file_range):
+	return len(list(file_range))
+
+
 class TestFolderResource(TestCase):
 
 	def setUp(self):
@@ -23,7 +47,8 @@ class TestFolderResource(TestCase):
 
 	def tearDown(self):
 		shutil.rmtree(TEST_DIR)
-		shutil.rmtree('./linguini_markers')
+		if os.path.exists('./linguini_markers'):
+			shutil.rmtree('./linguini_markers')
 
 	def test_basic_write(self):
 
@@ -51,6 +76,1652 @@ class TestFolderResource(TestCase):
 		self.assertTrue(os.path.isfile(expected_file))
 
 
+	def test_manifest(self):
+
+		class MyTask(Task):
+			outputs = Folder(TEST_DIR, 'foldir', checksum=True)
+			num_runs = 0
+			def run(self):
+				self.num_runs += 1
+				self.outputs.open('a.txt', 'w').write('yo')
+				self.outputs.open('b.txt', 'w').write('hey')
+
+		task = MyTask()
+		class MyRunner(Runner):
+			lot = 'my_lot'
+			tasks = {
+				'task': task
+			}
+
+		# the folder is complete once the task has run, and isn't rerun
+		MyRunner().run()
+		MyRunner().run()
+		self.assertEqual(task.num_runs, 1)
+
+		folder = task.outputs
+		self.assertTrue(folder.exists())
+		self.assertTrue(folder.verify(checksum=True))
+		self.assertEqual(
+			[(f, s) for f, s, c in folder.read_manifest()],
+			[('a.txt', 2), ('b.txt', 3)]
+		)
+
+		# the manifest isn't yielded when iterating over the folder
+		self.assertEqual(
+			sorted([os.path.basename(f) for f in folder]), ['a.txt', 'b.txt'])
+
+		# tampering is detected by verify
+		open(folder.get_fname('b.txt'), 'w').write('hi!')
+		self.assertTrue(folder.verify())
+		self.assertFalse(folder.verify(checksum=True))
+		os.remove(folder.get_fname('a.txt'))
+		self.assertFalse(folder.verify())
+
+
+class TestIncrementalFolder(TestCase):
+
+	def setUp(self):
+		os.mkdir(TEST_DIR)
+		os.mkdir(os.path.join(TEST_DIR, 'in'))
+
+	def tearDown(self):
+		shutil.rmtree(TEST_DIR)
+		if os.path.exists('./linguini_markers'):
+			shutil.rmtree('./linguini_markers')
+
+	def test_only_new_files_processed(self):
+
+		seen = []
+		class MyTask(SimpleTask):
+			inputs = Folder(TEST_DIR, 'in', static=True, incremental=True)
+			outputs = File(TEST_DIR, 'out.txt')
+			def run(self):
+				out = self.outputs.open('a')
+				for path in self.inputs:
+					seen.append(os.path.basename(path))
+					out.write(open(path).read())
+
+		class MyRunner(Runner):
+			lot = 'my_lot'
+			tasks = {
+				'task': MyTask()
+			}
+
+		open(os.path.join(TEST_DIR, 'in', 'a.txt'), 'w').write('a')
+		open(os.path.join(TEST_DIR, 'in', 'b.txt'), 'w').write('b')
+		MyRunner().run()
+		self.assertEqual(sorted(seen), ['a.txt', 'b.txt'])
+
+		# nothing new, so the task is complete and isn't run
+		del seen[:]
+		MyRunner().run()
+		self.assertEqual(seen, [])
+
+		# a new file and a changed file are processed, the rest isn't
+		open(os.path.join(TEST_DIR, 'in', 'c.txt'), 'w').write('c')
+		open(os.path.join(TEST_DIR, 'in', 'a.txt'), 'w').write('aa')
+		MyRunner().run()
+		self.assertEqual(sorted(seen), ['a.txt', 'c.txt'])
+
+		# results accumulated into the existing output
+		out_path = os.path.join(TEST_DIR, 'my_lot_out.txt')
+		self.assertEqual(sorted(open(out_path).read()), list('aaabc'))
+
+		# clobbering reprocesses everything
+		del seen[:]
+		MyRunner().run(clobber=True)
+		self.assertEqual(sorted(seen), ['a.txt', 'b.txt', 'c.txt'])
+
+	def run_produced(self, seen):
+
+		class Produce(Task):
+			outputs = Folder(TEST_DIR, 'made')
+			def run(self):
+				self.outputs.open('a.txt', 'w').write('a')
+				self.outputs.open('b.txt', 'w').write('b')
+
+		class Consume(SimpleTask):
+			inputs = Folder(TEST_DIR, 'made', incremental=True)
+			outputs = File(TEST_DIR, 'out.txt')
+			def run(self):
+				out = self.outputs.open('w')
+				for path in self.inputs:
+					seen.append(os.path.basename(path))
+					out.write(open(path).read())
+
+		class MyRunner(Runner):
+			lot = 'my_lot'
+			tasks = {
+				'produce': Produce(),
+				'consume': (Consume(), 'produce'),
+			}
+
+		MyRunner().run()
+
+	def test_produced_in_same_run(self):
+
+		# the folder doesn't exist while the run is being planned
+		seen = []
+		self.run_produced(seen)
+		self.assertEqual(sorted(seen), ['a.txt', 'b.txt'])
+
+		# the files were recorded as consumed
+		del seen[:]
+		self.run_produced(seen)
+		self.assertEqual(seen, [])
+
+	def test_produced_into_empty_folder(self):
+		os.mkdir(os.path.join(TEST_DIR, 'my_lot_made'))
+		seen = []
+		self.run_produced(seen)
+		self.assertEqual(sorted(seen), ['a.txt', 'b.txt'])
+
+
+class TestIncrementalFile(TestCase):
+
+	def setUp(self):
+		os.mkdir(TEST_DIR)
+
+	def tearDown(self):
+		shutil.rmtree(TEST_DIR)
+		if os.path.exists('./linguini_markers'):
+			shutil.rmtree('./linguini_markers')
+
+	def test_resume_from_unmarked_part(self):
+
+		written = []
+		class MyTask(Task):
+			outputs = IncrementalFile(TEST_DIR, 'out.txt', 4)
+			crash_at = None
+			def run(self):
+				for part in self.outputs.remaining():
+					self.outputs.open(part, 'w').write(str(part))
+					if part == self.crash_at:
+						raise KeyboardInterrupt
+					written.append(part)
+					self.outputs.mark_as_done(part)
+
+		task = MyTask()
+		class MyRunner(Runner):
+			lot = 'my_lot'
+			tasks = {
+				'task': task
+			}
+
+		# the task gets interrupted while writing the third part
+		task.crash_at = 2
+		with self.assertRaises(KeyboardInterrupt):
+			MyRunner().run()
+		self.assertEqual(written, [0, 1])
+		self.assertFalse(task.exists())
+
+		# on the rerun, it picks up at the third part
+		task.crash_at = None
+		MyRunner().run()
+		self.assertEqual(written, [0, 1, 2, 3])
+		self.assertTrue(task.exists())
+		self.assertEqual(
+			''.join([open(p).read() for p in task.outputs]), '0123')
+
+		# it is complete, so it isn't rerun, unless clobbering
+		MyRunner().run()
+		self.assertEqual(written, [0, 1, 2, 3])
+		MyRunner().run(clobber=True)
+		self.assertEqual(written, [0, 1, 2, 3, 0, 1, 2, 3])
+
+
+class TestCompression(TestCase):
+
+	def setUp(self):
+		os.mkdir(TEST_DIR)
+
+	def tearDown(self):
+		shutil.rmtree(TEST_DIR)
+
+	def get_ready(self, resource):
+		resource.get_ready(lot='my_lot', pilot=False, name='t', clobber=False)
+		return resource
+
+	def test_infer_from_extension(self):
+		my_file = self.get_ready(File(TEST_DIR, 'out.txt.gz'))
+		my_file.open('w').write('yo\n' * 100)
+
+		# the file is gzipped, but reads back transparently
+		self.assertEqual(
+			gzip.open(my_file.get_path()).read(), 'yo\n' * 100)
+		self.assertEqual(my_file.open('r').read(), 'yo\n' * 100)
+
+		# compress=False disables inference
+		plain = self.get_ready(File(TEST_DIR, 'plain.gz', compress=False))
+		plain.open('w').write('yo')
+		self.assertEqual(open(plain.get_path()).read(), 'yo')
+
+	def test_explicit_compression(self):
+		my_file = self.get_ready(File(TEST_DIR, 'out.txt', compress='bz2'))
+		my_file.open('w').write('yo')
+		self.assertTrue(open(my_file.get_path()).read() != 'yo')
+		self.assertEqual(my_file.open('r').read(), 'yo')
+
+		folder = self.get_ready(Folder(TEST_DIR, 'dir'))
+		folder.open('a.txt', 'w', compress='gzip').write('a')
+		folder.open('b.txt.gz', 'w').write('b')
+		self.assertEqual(gzip.open(folder.get_fname('a.txt')).read(), 'a')
+		self.assertEqual(folder.open('b.txt.gz', 'r').read(), 'b')
+
+	def test_parallel_gzip(self):
+		lines = ['line %d\n' % i for i in range(20000)]
+		my_file = self.get_ready(File(TEST_DIR, 'out.gz', threads=4))
+		writer = my_file.open('w')
+		self.assertTrue(isinstance(writer, ParallelGzipWriter))
+
+		# use small blocks to get many gzip members
+		writer.block_size = 1000
+		writer.writelines(lines)
+		writer.close()
+		self.assertEqual(my_file.open('r').read(), ''.join(lines))
+
+
+class TestMemoryMap(TestCase):
+
+	def setUp(self):
+		os.mkdir(TEST_DIR)
+
+	def tearDown(self):
+		shutil.rmtree(TEST_DIR)
+
+	def test_mmap_and_buffer(self):
+
+		# the map follows lot and pilot resolution like open does
+		my_file = File(TEST_DIR, 'in.txt')
+		my_file.get_ready(lot='my_lot', pilot=True, name='t', clobber=False)
+		my_file.open('w').write('0123456789')
+		self.assertTrue(my_file.get_path().endswith('my_lot_pilot_in.txt'))
+
+		mapped = my_file.mmap()
+		self.assertEqual(mapped[2:5], '234')
+		with self.assertRaises(TypeError):
+			mapped[0] = 'x'
+
+		buf = my_file.buffer()
+		self.assertEqual(len(buf), 10)
+		self.assertEqual(str(buf[7:]), '789')
+
+		# pickling re-maps the same file rather than copying the data
+		unpickled = pickle.loads(pickle.dumps(mapped))
+		self.assertEqual(unpickled[:], '0123456789')
+
+	def test_mmap_compressed(self):
+		my_file = File(TEST_DIR, 'in.txt.gz')
+		my_file.get_ready(lot='my_lot', pilot=False, name='t', clobber=False)
+		my_file.open('w').write('yo')
+		with self.assertRaises(ResourceException):
+			my_file.mmap()
+
+
+class TestSplit(TestCase):
+
+	def setUp(self):
+		os.mkdir(TEST_DIR)
+
+	def tearDown(self):
+		shutil.rmtree(TEST_DIR)
+
+	def test_split_on_lines(self):
+		lines = ['%s\n' % ('x' * (i % 17)) for i in range(1000)]
+		my_file = File(TEST_DIR, 'in.txt')
+		my_file.get_ready(lot='my_lot', pilot=False, name='t', clobber=False)
+		my_file.open('w').write(''.join(lines))
+
+		ranges = my_file.split(7)
+		self.assertEqual(len(ranges), 7)
+
+		# every range is made of whole lines, and together they are the file
+		found_lines = []
+		for file_range in ranges:
+			range_lines = list(file_range)
+			self.assertTrue(all([l.endswith('\n') for l in range_lines]))
+			found_lines.extend(range_lines)
+		self.assertEqual(found_lines, lines)
+		self.assertEqual(
+			''.join([r.open().read() for r in ranges]), ''.join(lines))
+
+		# ranges can be handed to worker processes
+		pool = multiprocessing.Pool(3)
+		counts = pool.map(count_lines, ranges)
+		pool.close()
+		pool.join()
+		self.assertEqual(sum(counts), 1000)
+
+	def test_more_ranges_than_lines(self):
+		my_file = File(TEST_DIR, 'in.txt')
+		my_file.get_ready(lot='my_lot', pilot=False, name='t', clobber=False)
+		my_file.open('w').write('a\nb\n')
+		ranges = my_file.split(5)
+		self.assertEqual(len(ranges), 5)
+		self.assertEqual([l for r in ranges for l in r], ['a\n', 'b\n'])
+
+
+class CachedTask(Task):
+	inputs = File(TEST_DIR, 'in.txt', static=True)
+	outputs = {
+		'text': File(TEST_DIR, 'out.txt'),
+		'folder': Folder(TEST_DIR, 'out_dir'),
+	}
+	runs = []
+	def run(self):
+		self.runs.append(self.parameters)
+		text = self.inputs.open('r').read() * self.parameters['times']
+		self.outputs['text'].open('w').write(text)
+		self.outputs['folder'].open('a.txt', 'w').write(text)
+
+
+class TestOutputCache(TestCase):
+
+	CACHE_DIR = os.path.join(TEST_DIR, 'cache')
+
+	def setUp(self):
+		os.mkdir(TEST_DIR)
+		open(os.path.join(TEST_DIR, 'in.txt'), 'w').write('yo')
+		del CachedTask.runs[:]
+
+	def tearDown(self):
+		shutil.rmtree(TEST_DIR)
+
+	def make_runner(self, lot_name, times):
+		class MyRunner(Runner):
+			lot = lot_name
+			tasks = {
+				'task': CachedTask(times=times)
+			}
+		return MyRunner()
+
+	def test_reuse_across_lots(self):
+		cache = OutputCache(self.CACHE_DIR)
+		self.make_runner('lot_a', 2).run(cache=cache)
+		self.assertEqual(len(CachedTask.runs), 1)
+
+		# an identical task in another lot is restored, not rerun
+		self.make_runner('lot_b', 2).run(cache=cache)
+		self.assertEqual(len(CachedTask.runs), 1)
+		for fname in ['lot_b_out.txt', os.path.join('lot_b_out_dir', 'a.txt')]:
+			self.assertEqual(
+				open(os.path.join(TEST_DIR, fname)).read(), 'yoyo')
+
+		# the restored folder is complete
+		folder = Folder(TEST_DIR, 'out_dir')
+		folder.get_ready('lot_b', False, 'task', False)
+		self.assertTrue(folder.verify())
+
+		# restored outputs are copies, so rewriting one in place leaves the
+		# others alone
+		open(os.path.join(TEST_DIR, 'lot_a_out_dir', 'a.txt'), 'w').write('x')
+		self.assertEqual(
+			open(os.path.join(TEST_DIR, 'lot_b_out_dir', 'a.txt')).read(), 
+			'yoyo')
+
+		# different parameters, or different inputs, mean a new computation
+		self.make_runner('lot_c', 3).run(cache=cache)
+		self.assertEqual(len(CachedTask.runs), 2)
+		open(os.path.join(TEST_DIR, 'in.txt'), 'w').write('hi')
+		self.make_runner('lot_d', 2).run(cache=cache)
+		self.assertEqual(len(CachedTask.runs), 3)
+		self.assertEqual(
+			open(os.path.join(TEST_DIR, 'lot_d_out.txt')).read(), 'hihi')
+
+	def test_lru_eviction(self):
+		cache = OutputCache(self.CACHE_DIR)
+		self.make_runner('lot_a', 1).run(cache=cache)
+		self.make_runner('lot_b', 2).run(cache=cache)
+		entries = sorted(cache.get_entries())
+		self.assertEqual(len(entries), 2)
+
+		# make the smaller entry the least recently used, then shrink the 
+		# cache so that only one entry fits
+		smaller, larger = sorted(entries, key=lambda e: e[1])
+		os.utime(os.path.join(smaller[2], 'index'), (0, 0))
+		cache.max_bytes = larger[1]
+		cache.evict()
+		remaining = cache.get_entries()
+		self.assertEqual([e[2] for e in remaining], [larger[2]])
+
+
+class TestRebuildStale(TestCase):
+
+	def setUp(self):
+		os.mkdir(TEST_DIR)
+
+	def tearDown(self):
+		shutil.rmtree(TEST_DIR)
+
+	def test_rebuild_stale(self):
+
+		runs = []
+		class CopyTask(Task):
+			def __init__(self, fname_in, fname_out):
+				super(CopyTask, self).__init__(
+					fname_in=fname_in, fname_out=fname_out)
+				self.inputs = File(TEST_DIR, fname_in, static=True)
+				self.outputs = File(TEST_DIR, fname_out, static=True)
+			def run(self):
+				runs.append(self.name)
+				self.outputs.open('w').write(self.inputs.open('r').read())
+
+		class MyRunner(Runner):
+			lot = 'my_lot'
+			tasks = {
+				'A': CopyTask('0.txt', 'a.txt'),
+				'B': (CopyTask('a.txt', 'b.txt'), 'A'),
+				'C': (CopyTask('b.txt', 'c.txt'), 'B'),
+				'D': CopyTask('x.txt', 'd.txt'),
+			}
+
+		def path(fname):
+			return os.path.join(TEST_DIR, fname)
+
+		open(path('0.txt'), 'w').write('yo')
+		open(path('x.txt'), 'w').write('hi')
+		MyRunner().run()
+		self.assertEqual(sorted(runs), ['A', 'B', 'C', 'D'])
+
+		# age all the files, then regenerate the first input
+		for fname in os.listdir(TEST_DIR):
+			os.utime(path(fname), (1000, 1000))
+		open(path('0.txt'), 'w').write('hey')
+
+		# by default, outputs that exist are assumed current
+		del runs[:]
+		MyRunner().run()
+		self.assertEqual(runs, [])
+
+		# when rebuilding stale outputs, A and everything after it reruns
+		MyRunner().run(rebuild_stale=True)
+		self.assertEqual(runs, ['A', 'B', 'C'])
+		self.assertEqual(open(path('c.txt')).read(), 'hey')
+
+		# now everything is current
+		del runs[:]
+		MyRunner().run(rebuild_stale=True)
+		self.assertEqual(runs, [])
+
+	def test_each_task_checked_once(self):
+
+		# a ladder of diamonds, which has 2**20 paths from top to bottom
+		class Step(Task):
+			outputs = None
+		tasks = {'0a': Step(), '0b': Step()}
+		for level in range(1, 20):
+			for side in 'ab':
+				tasks['%d%s' % (level, side)] = (
+					Step(), '%da' % (level - 1), '%db' % (level - 1))
+
+		checked = []
+		class MyRunner(Runner):
+			lot = 'my_lot'
+			def is_stale(self, task):
+				checked.append(task.name)
+				return False
+
+		MyRunner.tasks = tasks
+		MyRunner().run(until='19a', rebuild_stale=True)
+		self.assertEqual(len(set(checked)), 39)
+		self.assertEqual(len(checked), 39)
+
+
+class TestEarlyCutoff(TestCase):
+
+	def setUp(self):
+		os.mkdir(TEST_DIR)
+
+	def tearDown(self):
+		shutil.rmtree(TEST_DIR)
+		if os.path.exists('./linguini_markers'):
+			shutil.rmtree('./linguini_markers')
+
+	def test_unchanged_output_cuts_off(self):
+
+		runs = []
+		class LengthTask(Task):
+			inputs = File(TEST_DIR, '0.txt', static=True)
+			outputs = File(TEST_DIR, 'a.txt')
+			def run(self):
+				runs.append(self.name)
+				length = len(self.inputs.open('r').read())
+				self.outputs.open('w').write(str(length))
+
+		class CopyTask(Task):
+			def __init__(self, fname_in, fname_out):
+				super(CopyTask, self).__init__(
+					fname_in=fname_in, fname_out=fname_out)
+				self.inputs = File(TEST_DIR, fname_in)
+				self.outputs = File(TEST_DIR, fname_out)
+			def run(self):
+				runs.append(self.name)
+				self.outputs.open('w').write(self.inputs.open('r').read())
+
+		class MyRunner(Runner):
+			lot = 'my_lot'
+			tasks = {
+				'A': LengthTask(),
+				'B': (CopyTask('a.txt', 'b.txt'), 'A'),
+				'C': (CopyTask('b.txt', 'c.txt'), 'B'),
+			}
+
+		def path(fname):
+			return os.path.join(TEST_DIR, fname)
+
+		open(path('0.txt'), 'w').write('yo')
+		MyRunner().run(early_cutoff=True)
+		self.assertEqual(runs, ['A', 'B', 'C'])
+
+		# the input changes, but the length, and so A's output, doesn't
+		for fname in os.listdir(TEST_DIR):
+			os.utime(path(fname), (1000, 1000))
+		open(path('0.txt'), 'w').write('hi')
+
+		# A is rebuilt, but B and C needn't be
+		del runs[:]
+		MyRunner().run(rebuild_stale=True, early_cutoff=True)
+		self.assertEqual(runs, ['A'])
+
+		# and they aren't considered stale afterwards
+		MyRunner().run(rebuild_stale=True, early_cutoff=True)
+		self.assertEqual(runs, ['A'])
+
+		# when A's output does change, everything downstream is rebuilt
+		os.utime(path('my_lot_a.txt'), (1000, 1000))
+		open(path('0.txt'), 'w').write('hey')
+		del runs[:]
+		MyRunner().run(rebuild_stale=True, early_cutoff=True)
+		self.assertEqual(runs, ['A', 'B', 'C'])
+		self.assertEqual(open(path('my_lot_c.txt')).read(), '3')
+
+
+class TestInvalidate(TestCase):
+
+	def setUp(self):
+		os.mkdir(TEST_DIR)
+
+	def tearDown(self):
+		shutil.rmtree(TEST_DIR)
+
+	def test_invalidate_reschedules_dependents(self):
+
+		runs = []
+		class MyTask(MarkedTask):
+			marker_path = TEST_DIR
+			def run(self):
+				runs.append(self.name)
+
+		class MyRunner(Runner):
+			lot = 'my_lot'
+			tasks = {
+				'A': MyTask(),
+				'B': (MyTask(), 'A'),
+				'C': (MyTask(), 'B'),
+				'D': (MyTask(), 'A'),
+				'E': MyTask(),
+			}
+
+		MyRunner().run()
+		self.assertEqual(sorted(runs), ['A', 'B', 'C', 'D', 'E'])
+
+		# only B and what depends on it are rerun
+		del runs[:]
+		MyRunner().run(invalidate=['B'])
+		self.assertEqual(runs, ['B', 'C'])
+
+		# until still limits what gets run
+		del runs[:]
+		MyRunner().run(invalidate='A', until='D')
+		self.assertEqual(sorted(runs), ['A', 'D'])
+
+		with self.assertRaises(RunnerException):
+			MyRunner().run(invalidate=['F'])
+
+
+class TestMemoryResource(TestCase):
+
+	def setUp(self):
+		os.mkdir(TEST_DIR)
+		self.budget = memory_store.budget
+
+	def tearDown(self):
+		shutil.rmtree(TEST_DIR)
+		memory_store.budget = self.budget
+
+	def make_runner(self, seen):
+
+		class Producer(Task):
+			outputs = MemoryResource(TEST_DIR, 'numbers.pkl')
+			def run(self):
+				self.outputs.dump(range(1000))
+
+		class Consumer(Task):
+			inputs = MemoryResource(TEST_DIR, 'numbers.pkl')
+			outputs = File(TEST_DIR, 'total.txt')
+			def run(self):
+				numbers = self.inputs.load()
+				seen.append((
+					self.inputs.get_key() in memory_store.objects,
+					self.inputs.is_spilled()
+				))
+				self.outputs.open('w').write(str(sum(numbers)))
+
+		class MyRunner(Runner):
+			lot = 'my_lot'
+			tasks = {
+				'produce': Producer(),
+				'consume': (Consumer(), 'produce'),
+			}
+
+		return MyRunner()
+
+	def test_kept_in_memory(self):
+		seen = []
+		self.make_runner(seen).run()
+		self.assertEqual(seen, [(True, False)])
+		self.assertEqual(
+			open(os.path.join(TEST_DIR, 'my_lot_total.txt')).read(), 
+			str(sum(range(1000)))
+		)
+
+		# once the consumer is done, the object is dropped
+		self.assertEqual(memory_store.objects, {})
+		self.assertFalse(
+			os.path.exists(os.path.join(TEST_DIR, 'my_lot_numbers.pkl')))
+
+	def test_spill_over_budget(self):
+		memory_store.budget = 1000
+		seen = []
+		self.make_runner(seen).run()
+		self.assertEqual(seen, [(False, True)])
+		self.assertEqual(
+			open(os.path.join(TEST_DIR, 'my_lot_total.txt')).read(), 
+			str(sum(range(1000)))
+		)
+
+	def test_explicit_spill(self):
+		resource = MemoryResource(TEST_DIR, 'obj.pkl')
+		resource.get_ready('my_lot', False, 'task', False)
+		resource.dump({'a': 1})
+		self.assertFalse(resource.is_spilled())
+		resource.spill()
+		self.assertTrue(resource.is_spilled())
+		self.assertTrue(resource.get_key() not in memory_store.objects)
+		self.assertEqual(resource.load(), {'a': 1})
+
+
+class TestBinaryFiles(TestCase):
+
+	def setUp(self):
+		os.mkdir(TEST_DIR)
+
+	def tearDown(self):
+		shutil.rmtree(TEST_DIR)
+
+	def test_pickle_file(self):
+		obj = {'words': ['a', 'b'], 'counts': (1, 2)}
+		pickle_file = PickleFile(TEST_DIR, 'obj.pkl')
+		pickle_file.get_ready('my_lot', True, 'task', False)
+		pickle_file.dump(obj)
+		self.assertTrue(
+			pickle_file.get_path().endswith('my_lot_pilot_obj.pkl'))
+		self.assertEqual(pickle_file.load(), obj)
+
+		# like other files, it isn't overwritten unless clobbering
+		with self.assertRaises(IOError):
+			pickle_file.dump(obj)
+		pickle_file.get_ready('my_lot', True, 'task', True)
+		pickle_file.dump([1])
+		self.assertEqual(pickle_file.load(), [1])
+
+	@unittest.skipIf(numpy is None, 'numpy is not installed')
+	def test_array_file(self):
+		array_file = ArrayFile(TEST_DIR, 'features.npy')
+		array_file.get_ready('my_lot', False, 'task', False)
+		array_file.dump(numpy.arange(12).reshape(3, 4))
+		loaded = array_file.load()
+		self.assertTrue(isinstance(loaded, numpy.memmap))
+		self.assertEqual(loaded[2, 3], 11)
+		self.assertFalse(loaded.flags.writeable)
+
+
+class TestStreaming(TestCase):
+
+	def setUp(self):
+		os.mkdir(TEST_DIR)
+
+	def tearDown(self):
+		shutil.rmtree(TEST_DIR)
+
+	def make_runner(self, persist=True, fail=False, consumer_fail=False):
+
+		first_line_read = threading.Event()
+		self.overlapped = []
+		test = self
+
+		class Producer(Task):
+			outputs = File(TEST_DIR, 'tokens.txt', persist=persist)
+			def run(self):
+				out = self.outputs.open('w')
+				out.write('first\n')
+				out.flush()
+
+				# the consumer gets the first line before we're done
+				test.overlapped.append(first_line_read.wait(5))
+				out.writelines(['%d\n' % i for i in range(10000)])
+				if fail:
+					raise ValueError('oops')
+
+		class Consumer(Task):
+			inputs = File(TEST_DIR, 'tokens.txt', stream=True)
+			outputs = File(TEST_DIR, 'count.txt')
+			def run(self):
+				count = 0
+				out = self.outputs.open('w')
+				for line in self.inputs.open('r'):
+					first_line_read.set()
+					count += 1
+					if consumer_fail and count == 100:
+						out.close()
+						raise ValueError('oops')
+				out.write(str(count))
+
+		class MyRunner(Runner):
+			lot = 'my_lot'
+			tasks = {
+				'produce': Producer(),
+				'consume': (Consumer(), 'produce'),
+			}
+
+		return MyRunner()
+
+	def path(self, fname):
+		return os.path.join(TEST_DIR, 'my_lot_%s' % fname)
+
+	def test_stream_with_tee(self):
+		self.make_runner().run()
+		self.assertEqual(self.overlapped, [True])
+		self.assertEqual(open(self.path('count.txt')).read(), '10001')
+		self.assertEqual(len(open(self.path('tokens.txt')).readlines()), 10001)
+
+	def test_stream_without_persisting(self):
+		self.make_runner(persist=False).run()
+		self.assertEqual(self.overlapped, [True])
+		self.assertEqual(open(self.path('count.txt')).read(), '10001')
+		self.assertFalse(os.path.exists(self.path('tokens.txt')))
+
+	def test_producer_failure(self):
+		with self.assertRaises(ValueError):
+			self.make_runner(fail=True).run()
+		self.assertFalse(os.path.exists(self.path('count.txt')))
+
+	def test_consumer_failure(self):
+		with self.assertRaises(ValueError):
+			self.make_runner(consumer_fail=True).run()
+		self.assertFalse(os.path.exists(self.path('count.txt')))
+		self.assertFalse(os.path.exists(self.path('count.txt.partial')))
+
+	def test_consumer_failure_keep_going(self):
+		runner = self.make_runner(consumer_fail=True)
+		with self.assertRaises(RunnerException) as context:
+			runner.run(keep_going=True)
+
+		# the producer finished, and only the consumer is blamed
+		failed = re.findall(r'task (\S+) failed', str(context.exception))
+		self.assertEqual(failed, ['consume'])
+		self.assertEqual(len(open(self.path('tokens.txt')).readlines()), 10001)
+		self.assertTrue('produce' in runner.durations)
+
+
+class TestParallel(TestCase):
+
+	def setUp(self):
+		os.mkdir(TEST_DIR)
+
+	def tearDown(self):
+		shutil.rmtree(TEST_DIR)
+		if os.path.exists('linguini_markers'):
+			shutil.rmtree('linguini_markers')
+
+	def make_runner(self, fail=False):
+
+		def make_step(name):
+			class Step(Task):
+				outputs = File(TEST_DIR, '%s.txt' % name)
+				def run(self):
+					if fail and name == 'b':
+						raise ValueError('oops')
+					self.outputs.open('w').write(str(os.getpid()))
+			return Step()
+
+		class MyRunner(Runner):
+			lot = 'my_lot'
+			tasks = {
+				'a': make_step('a'),
+				'b': (make_step('b'), 'a'),
+				'c': (make_step('c'), 'b'),
+				'd': make_step('d'),
+				'e': (make_step('e'), 'c', 'd'),
+			}
+
+		return MyRunner()
+
+	def read_pid(self, name):
+		return open(os.path.join(TEST_DIR, 'my_lot_%s.txt' % name)).read()
+
+	def test_plan_units(self):
+		runner = self.make_runner()
+		runner.run(until='e', workers=2)
+		runner.schedule = set(['a', 'b', 'c', 'd', 'e'])
+		self.assertEqual(runner.plan_units(), [['a', 'b', 'c'], ['d'], ['e']])
+
+	def test_fused_chain(self):
+		self.make_runner().run(until='e', workers=2)
+		pids = dict([(n, self.read_pid(n)) for n in 'abcde'])
+		self.assertEqual(pids['a'], pids['b'])
+		self.assertEqual(pids['a'], pids['c'])
+		self.assertNotEqual(pids['a'], str(os.getpid()))
+
+	def test_failure(self):
+		runner = self.make_runner(fail=True)
+		with self.assertRaises(RunnerException):
+			runner.run(until='e', workers=2)
+		self.assertTrue(os.path.exists(os.path.join(TEST_DIR, 'my_lot_d.txt')))
+		self.assertFalse(os.path.exists(os.path.join(TEST_DIR, 'my_lot_e.txt')))
+
+
+class TestWarmWorkers(TestCase):
+
+	def setUp(self):
+		os.mkdir(TEST_DIR)
+
+	def tearDown(self):
+		shutil.rmtree(TEST_DIR)
+
+	def make_runner(self):
+
+		class Tag(Task):
+			lexicon = None
+
+			@classmethod
+			def worker_init(cls):
+				open(os.path.join(TEST_DIR, 'inits.txt'), 'a').write('init\n')
+				cls.lexicon = {'cat': 'NOUN'}
+
+			def run(self):
+				self.outputs.open('w').write(self.lexicon['cat'])
+
+		def make_tag(i):
+			class MyTag(Tag):
+				outputs = File(TEST_DIR, '%d.txt' % i)
+			return MyTag()
+
+		class MyRunner(Runner):
+			lot = 'my_lot'
+			tasks = dict([('tag%d' % i, make_tag(i)) for i in range(6)])
+
+		return MyRunner()
+
+	def count_inits(self):
+		return len(open(os.path.join(TEST_DIR, 'inits.txt')).readlines())
+
+	def test_init_once_per_worker(self):
+		self.make_runner().run(workers=2, warm_workers=True)
+		self.assertTrue(self.count_inits() <= 2)
+		for i in range(6):
+			fname = os.path.join(TEST_DIR, 'my_lot_%d.txt' % i)
+			self.assertEqual(open(fname).read(), 'NOUN')
+
+	def test_cold_workers(self):
+		self.make_runner().run(workers=2)
+		self.assertEqual(self.count_inits(), 6)
+
+
+class TestBroadcast(TestCase):
+
+	def setUp(self):
+		os.mkdir(TEST_DIR)
+
+	def tearDown(self):
+		shutil.rmtree(TEST_DIR)
+
+	def make_runner(self, dog=1):
+
+		class Vocabulary(PickleFile):
+			def load_broadcast(self):
+				open(os.path.join(TEST_DIR, 'loads.txt'), 'a').write('load\n')
+				return super(Vocabulary, self).load_broadcast()
+
+		class MakeVocabulary(Task):
+			outputs = PickleFile(TEST_DIR, 'vocab.pkl')
+			def run(self):
+				self.outputs.dump({'cat': 0, 'dog': dog})
+
+		def make_lookup(i):
+			class Lookup(Task):
+				inputs = Vocabulary(TEST_DIR, 'vocab.pkl', broadcast=True)
+				outputs = File(TEST_DIR, '%d.txt' % i)
+				def run(self):
+					vocab = self.inputs.load()
+					self.outputs.open('w').write(str(vocab['dog']))
+			return Lookup()
+
+		class MyRunner(Runner):
+			lot = 'my_lot'
+			tasks = dict([
+				('lookup%d' % i, (make_lookup(i), 'vocab')) for i in range(4)])
+			tasks['vocab'] = MakeVocabulary()
+
+		return MyRunner()
+
+	def count_loads(self):
+		return len(open(os.path.join(TEST_DIR, 'loads.txt')).readlines())
+
+	def test_loaded_once(self):
+		self.make_runner().run(workers=2)
+		self.assertEqual(self.count_loads(), 1)
+		for i in range(4):
+			fname = os.path.join(TEST_DIR, 'my_lot_%d.txt' % i)
+			self.assertEqual(open(fname).read(), '1')
+
+	def test_serial(self):
+		self.make_runner().run()
+		self.assertEqual(self.count_loads(), 1)
+
+	def test_rewritten_with_warm_workers(self):
+		self.make_runner().run()
+
+		# the vocabulary that's loaded is the one written during the run
+		self.make_runner(dog=2).run(workers=2, warm_workers=True, clobber=True)
+		for i in range(4):
+			fname = os.path.join(TEST_DIR, 'my_lot_%d.txt' % i)
+			self.assertEqual(open(fname).read(), '2')
+
+	def test_warm_workers(self):
+		vocab = PickleFile(TEST_DIR, 'vocab.pkl', static=True)
+		vocab.get_ready('my_lot', False, 'test', False)
+		vocab.dump({'dog': 1})
+
+		class Vocabulary(PickleFile):
+			def load_broadcast(self):
+				open(os.path.join(TEST_DIR, 'loads.txt'), 'a').write('load\n')
+				return super(Vocabulary, self).load_broadcast()
+
+		def make_step(name, lookup):
+			class Step(Task):
+				inputs = (
+					Vocabulary(TEST_DIR, 'vocab.pkl', static=True, broadcast=True)
+					if lookup else None
+				)
+				outputs = File(TEST_DIR, '%s.txt' % name)
+				def run(self):
+					if lookup:
+						self.inputs.load()
+					time.sleep(0.1)
+					self.outputs.open('w').write(name)
+			return Step()
+
+		# the workers are started for the first tasks, which don't use the
+		# vocabulary, and are then reused for those that do
+		class MyRunner(Runner):
+			lot = 'my_lot'
+			tasks = dict(
+				[('a%d' % i, make_step('a%d' % i, False)) for i in range(2)]
+				+ [('b%d' % i, make_step('b%d' % i, True)) for i in range(4)]
+			)
+
+		MyRunner().run(workers=2, warm_workers=True)
+		self.assertEqual(self.count_loads(), 1)
+
+
+class TestCoordinatedRunners(TestCase):
+
+	def setUp(self):
+		os.mkdir(TEST_DIR)
+
+	def tearDown(self):
+		shutil.rmtree(TEST_DIR)
+
+	def make_runner(self):
+
+		def make_step(i):
+			class Step(Task):
+				outputs = File(TEST_DIR, '%d.txt' % i)
+				def run(self):
+					time.sleep(0.05)
+					log = open(os.path.join(TEST_DIR, 'runs.txt'), 'a')
+					log.write('%d\n' % i)
+					log.close()
+					self.outputs.open('w').write(str(os.getpid()))
+			return Step()
+
+		class MyRunner(Runner):
+			lot = 'my_lot'
+			lock_path = TEST_DIR
+			poll_interval = 0.05
+			tasks = dict([('step%d' % i, make_step(i)) for i in range(8)])
+			tasks['last'] = tuple(
+				[make_step(8)] + ['step%d' % i for i in range(8)])
+
+		return MyRunner()
+
+	def test_share_lot(self):
+		runners = [
+			multiprocessing.Process(
+				target=self.make_runner().run, 
+				kwargs={'until': 'last', 'coordinate': True}
+			)
+			for i in range(2)
+		]
+		for runner in runners:
+			runner.start()
+		for runner in runners:
+			runner.join()
+
+		# both runners finish cleanly, and each task was run once, by one
+		# of them
+		self.assertEqual([r.exitcode for r in runners], [0, 0])
+		runs = open(os.path.join(TEST_DIR, 'runs.txt')).read().split()
+		self.assertEqual(sorted(runs), [str(i) for i in range(9)])
+		pids = set([
+			open(os.path.join(TEST_DIR, 'my_lot_%d.txt' % i)).read()
+			for i in range(9)
+		])
+		self.assertTrue(pids <= set([str(r.pid) for r in runners]))
+
+	def test_clobber(self):
+		self.make_runner().run(until='last', coordinate=True)
+		os.remove(os.path.join(TEST_DIR, 'runs.txt'))
+
+		# a lone runner clobbering the lot reruns everything
+		self.make_runner().run(until='last', coordinate=True, clobber=True)
+		runs = open(os.path.join(TEST_DIR, 'runs.txt')).read().split()
+		self.assertEqual(sorted(runs), [str(i) for i in range(9)])
+
+	def test_stale_lock(self):
+		path = os.path.join(TEST_DIR, 'task.lock')
+		touch(path)
+		lock = TaskLock(path, timeout=0.2)
+		self.assertFalse(lock.acquire())
+		time.sleep(0.3)
+		self.assertTrue(lock.acquire())
+		self.assertTrue(lock.held)
+		lock.release()
+		self.assertFalse(os.path.exists(path))
+
+	def test_lock_broken_by_another(self):
+		path = os.path.join(TEST_DIR, 'task.lock')
+		touch(path)
+		late = TaskLock(path, timeout=0.1)
+		self.assertFalse(late.acquire())
+		time.sleep(0.2)
+		self.assertTrue(late.is_stale())
+
+		# another runner breaks the lock first, and takes a fresh one
+		os.remove(path)
+		other = TaskLock(path)
+		self.assertTrue(other.acquire())
+
+		# so the late runner leaves that one alone
+		late.break_lock()
+		self.assertTrue(os.path.exists(path))
+		self.assertFalse(late.acquire())
+		other.release()
+
+
+class RemoteStep(Task):
+
+	def _outputs(self):
+		return File(TEST_DIR, 'remote_%d.txt' % self.parameters['i'])
+
+	def run(self):
+		if self.parameters.get('fail'):
+			raise ValueError('oops')
+		self.outputs.open('w').write(str(os.getpid()))
+
+
+class TestDistributed(TestCase):
+
+	def setUp(self):
+		os.mkdir(TEST_DIR)
+
+		# find a free port
+		sock = socket.socket()
+		sock.bind(('localhost', 0))
+		self.address = sock.getsockname()
+		sock.close()
+
+		self.workers = [
+			multiprocessing.Process(target=work, args=(self.address, 5))
+			for i in range(2)
+		]
+		for worker in self.workers:
+			worker.start()
+
+	def tearDown(self):
+
+		# a worker that connects after the run is over would keep retrying
+		for worker in self.workers:
+			worker.join(0.5)
+			if worker.is_alive():
+				worker.terminate()
+		shutil.rmtree(TEST_DIR)
+
+	def make_runner(self, fail=False):
+
+		class MyRunner(Runner):
+			lot = 'my_lot'
+			tasks = dict([('step%d' % i, RemoteStep(i=i)) for i in range(6)])
+			tasks['last'] = tuple(
+				[RemoteStep(i=6, fail=fail)] + ['step%d' % i for i in range(6)])
+
+		return MyRunner()
+
+	def test_run_on_workers(self):
+		self.make_runner().run(until='last', address=self.address)
+		pids = set([
+			open(os.path.join(TEST_DIR, 'my_lot_remote_%d.txt' % i)).read()
+			for i in range(7)
+		])
+		self.assertTrue(pids <= set([str(w.pid) for w in self.workers]))
+
+	def test_failure(self):
+		with self.assertRaises(RunnerException):
+			self.make_runner(fail=True).run(until='last', address=self.address)
+		self.assertFalse(
+			os.path.exists(os.path.join(TEST_DIR, 'my_lot_remote_6.txt')))
+
+
+class TestChildren(TestCase):
+
+	def setUp(self):
+		os.mkdir(TEST_DIR)
+
+	def tearDown(self):
+		shutil.rmtree(TEST_DIR)
+
+	def make_runner(self, shards=3):
+
+		class Count(Task):
+			def _inputs(self):
+				shards = os.path.join(TEST_DIR, 'my_lot_shards')
+				return File(shards, self.parameters['fname'], static=True)
+			def _outputs(self):
+				return File(TEST_DIR, self.parameters['fname'] + '.count')
+			def run(self):
+				count = len(self.inputs.open('r').readlines())
+				self.outputs.open('w').write(str(count))
+
+		class Sum(Task):
+			outputs = File(TEST_DIR, 'total.txt')
+			def run(self):
+				total = sum([
+					int(open(os.path.join(TEST_DIR, f)).read())
+					for f in os.listdir(TEST_DIR) if f.endswith('.count')
+				])
+				self.outputs.open('w').write(str(total))
+
+		class Split(Task):
+			outputs = Folder(TEST_DIR, 'shards')
+			def run(self):
+				for i in range(shards):
+					self.outputs.open('%d.txt' % i, 'w').write('x\n' * (i + 1))
+			def children(self):
+				return dict([
+					(fname, Count(fname=fname))
+					for fname in os.listdir(self.outputs.get_path())
+					if fname.endswith('.txt')
+				])
+			def reducer(self):
+				return Sum()
+
+		class Report(Task):
+			outputs = File(TEST_DIR, 'report.txt')
+			def run(self):
+				total = open(os.path.join(TEST_DIR, 'my_lot_total.txt')).read()
+				self.outputs.open('w').write(total)
+
+		class MyRunner(Runner):
+			lot = 'my_lot'
+			tasks = {
+				'split': Split(),
+				'report': (Report(), 'split'),
+			}
+
+		return MyRunner()
+
+	def check(self):
+		report = open(os.path.join(TEST_DIR, 'my_lot_report.txt')).read()
+		self.assertEqual(report, '6')
+
+	def test_serial(self):
+		runner = self.make_runner()
+		runner.run(until='report')
+		self.check()
+		self.assertTrue('split.0.txt' in runner.tasks)
+		self.assertTrue('split.reduce' in runner.tasks)
+
+		# nothing is left to do the next time
+		runner = self.make_runner()
+		runner.run(until='report')
+		self.assertEqual(runner.schedule, set())
+
+	def test_no_children(self):
+		self.make_runner(shards=0).run(until='report')
+		report = open(os.path.join(TEST_DIR, 'my_lot_report.txt')).read()
+		self.assertEqual(report, '0')
+
+	def test_missing_child_with_cutoff(self):
+		self.make_runner().run(until='report')
+		count = os.path.join(TEST_DIR, 'my_lot_1.txt.count')
+		os.remove(count)
+
+		# the rebuilt parent doesn't change, but the child that isn't done
+		# still runs
+		self.make_runner().run(
+			until='report', invalidate='split', early_cutoff=True)
+		self.assertEqual(open(count).read(), '2')
+
+	def test_parallel(self):
+		self.make_runner().run(until='report', workers=2)
+		self.check()
+
+
+class TestShardedTask(TestCase):
+
+	def setUp(self):
+		os.mkdir(TEST_DIR)
+
+	def tearDown(self):
+		shutil.rmtree(TEST_DIR)
+
+	def make_runner(self, fail_shard=None):
+
+		class Squares(ShardedTask):
+			shards = 4
+			marker_path = TEST_DIR
+			outputs = File(TEST_DIR, 'total.txt')
+			def run_shard(self, i):
+				open(os.path.join(TEST_DIR, 'log.txt'), 'a').write('%d\n' % i)
+				if i == fail_shard:
+					raise ValueError('oops')
+				shard = os.path.join(TEST_DIR, 'shard%d.txt' % i)
+				open(shard, 'w').write(str(i * i))
+			def reduce(self):
+				total = sum([
+					int(open(os.path.join(TEST_DIR, 'shard%d.txt' % i)).read())
+					for i in range(self.get_shards())
+				])
+				self.outputs.open('w').write(str(total))
+
+		class MyRunner(Runner):
+			lot = 'my_lot'
+			tasks = {'squares': Squares()}
+
+		return MyRunner()
+
+	def read(self, fname):
+		return open(os.path.join(TEST_DIR, fname)).read()
+
+	def test_shards(self):
+		self.make_runner().run(workers=2)
+		self.assertEqual(self.read('my_lot_total.txt'), '14')
+		self.assertEqual(sorted(self.read('log.txt').split()), list('0123'))
+
+	def test_rerun_missing_shards(self):
+		with self.assertRaises(RunnerException):
+			self.make_runner(fail_shard=2).run(workers=2)
+		self.assertFalse(
+			os.path.exists(os.path.join(TEST_DIR, 'my_lot_total.txt')))
+
+		# only the shards that didn't finish are run again
+		done = set(self.read('log.txt').split()) - set(['2'])
+		os.remove(os.path.join(TEST_DIR, 'log.txt'))
+		self.make_runner().run(workers=2)
+		rerun = set(self.read('log.txt').split())
+		self.assertTrue('2' in rerun)
+		self.assertEqual(rerun & done, set())
+		self.assertEqual(self.read('my_lot_total.txt'), '14')
+
+	def test_cached_shards(self):
+		open(os.path.join(TEST_DIR, 'in.txt'), 'w').write('1')
+
+		class Mult(ShardedTask):
+			shards = 2
+			marker_path = TEST_DIR
+			inputs = File(TEST_DIR, 'in.txt', static=True)
+			def shard_outputs(self, i):
+				k = self.parameters['k']
+				return File(TEST_DIR, 'k%d_shard%d.txt' % (k, i))
+			def run_shard(self, i):
+				out = self.get_shard_outputs(i).open('w')
+				out.write(str(self.parameters['k'] * i))
+				out.close()
+
+		class MyRunner(Runner):
+			lot = 'my_lot'
+			tasks = {'m2': Mult(k=2), 'm3': Mult(k=3)}
+
+		# shards of differently parameterized tasks aren't mixed up
+		MyRunner().run(cache=OutputCache(os.path.join(TEST_DIR, 'cache')))
+		self.assertEqual(self.read('my_lot_k2_shard1.txt'), '2')
+		self.assertEqual(self.read('my_lot_k3_shard1.txt'), '3')
+
+
+class TestBatchTask(TestCase):
+
+	def setUp(self):
+		os.mkdir(TEST_DIR)
+
+	def tearDown(self):
+		shutil.rmtree(TEST_DIR)
+
+	def make_runner(self, batch_size=None, fail_at=None):
+
+		class Score(BatchTask):
+			def _outputs(self):
+				return File(TEST_DIR, 'score_%d.txt' % self.parameters['k'])
+			def run_batch(self, parameter_sets):
+				log = open(os.path.join(TEST_DIR, 'batches.txt'), 'a')
+				log.write('%d\n' % len(parameter_sets))
+				return [p['k'] * 10 for p in parameter_sets]
+			def save(self, result):
+				out = self.outputs.open('w')
+				out.write(str(result))
+				out.close()
+				if result == fail_at:
+					raise ValueError('oops')
+
+		Score.batch_size = batch_size
+
+		class MyRunner(Runner):
+			lot = 'my_lot'
+			tasks = dict([('score%d' % k, Score(k=k)) for k in range(5)])
+
+		return MyRunner()
+
+	def read(self, fname):
+		return open(os.path.join(TEST_DIR, fname)).read()
+
+	def check_scores(self):
+		for k in range(5):
+			self.assertEqual(self.read('my_lot_score_%d.txt' % k), str(k * 10))
+
+	def test_one_batch(self):
+		self.make_runner().run()
+		self.check_scores()
+		self.assertEqual(self.read('batches.txt').split(), ['5'])
+
+	def test_batch_size(self):
+		self.make_runner(batch_size=2).run(workers=2)
+		self.check_scores()
+		self.assertEqual(sorted(self.read('batches.txt').split()), list('122'))
+
+	def check_keep_going(self, **kwargs):
+		with self.assertRaises(RunnerException) as context:
+			self.make_runner(fail_at=30).run(keep_going=True, **kwargs)
+		failed = re.findall(r'task (\S+) failed', str(context.exception))
+		self.assertEqual(failed, ['score3'])
+
+		# the other instances were saved, and not run again
+		for k in [0, 1, 2, 4]:
+			self.assertEqual(self.read('my_lot_score_%d.txt' % k), str(k * 10))
+
+	def test_keep_going(self):
+		self.check_keep_going()
+
+	def test_keep_going_parallel(self):
+		self.check_keep_going(workers=2)
+
+	def test_failed_save(self):
+		with self.assertRaises(ValueError):
+			self.make_runner(fail_at=30).run()
+		fnames = os.listdir(TEST_DIR)
+		self.assertFalse('my_lot_score_3.txt' in fnames)
+		self.assertFalse(any([f.endswith('.partial') for f in fnames]))
+
+
+class TestSpeculation(TestCase):
+
+	def setUp(self):
+		os.mkdir(TEST_DIR)
+
+	def tearDown(self):
+		shutil.rmtree(TEST_DIR)
+
+	def make_runner(self):
+
+		class Squares(ShardedTask):
+			shards = 5
+			marker_path = TEST_DIR
+			def shard_outputs(self, i):
+				return File(TEST_DIR, 'shard%d.txt' % i)
+			def run_shard(self, i):
+				tried = os.path.join(TEST_DIR, 'shard%d.tried' % i)
+
+				# the first attempt at the last shard is very slow
+				try:
+					os.close(os.open(tried, os.O_CREAT | os.O_EXCL))
+					first = True
+				except OSError:
+					first = False
+				out = self.get_shard_outputs(i).open('w')
+				out.write('first' if first else 'backup')
+				out.close()
+				if i == 4 and first:
+					time.sleep(5)
+
+		class MyRunner(Runner):
+			lot = 'my_lot'
+			poll_interval = 0.05
+			tasks = {'squares': Squares()}
+
+		return MyRunner()
+
+	def test_backup_wins(self):
+		start = time.time()
+		self.make_runner().run(workers=3, speculate=True)
+		self.assertTrue(time.time() - start < 4)
+		shard = open(os.path.join(TEST_DIR, 'my_lot_shard4.txt')).read()
+		self.assertEqual(shard, 'backup')
+
+		# what the cancelled copy wrote was cleaned up
+		fnames = os.listdir(TEST_DIR)
+		self.assertFalse(any([f.endswith('.primary') for f in fnames]))
+
+	def test_report_from_cancelled_copy(self):
+		runner = self.make_runner()
+		report = {'unit': ['squares.shard4'], 'pid': 1}
+		self.assertFalse(runner.settle_copies(report, None, {}, set()))
+
+	def test_staged_file(self):
+		output = File(TEST_DIR, 'out.txt')
+		output.get_ready('my_lot', False, 'task', False)
+		path = output.get_path()
+		output.stage('backup')
+		output.open('w').write('staged')
+		self.assertFalse(os.path.exists(path))
+		output.commit()
+		self.assertEqual(open(path).read(), 'staged')
+		self.assertFalse(os.path.exists(path + '.backup'))
+
+
+class TestAtomicOutputs(TestCase):
+
+	def setUp(self):
+		os.mkdir(TEST_DIR)
+
+	def tearDown(self):
+		shutil.rmtree(TEST_DIR)
+
+	def make_runner(self, fail=False, atomic=True):
+
+		class Write(Task):
+			outputs = File(TEST_DIR, 'out.txt', atomic=atomic)
+			def run(self):
+				out = self.outputs.open('w')
+				out.write('partial')
+				out.close()
+				if fail:
+					raise ValueError('oops')
+				self.outputs.open('a').write(' and the rest')
+
+		class MyRunner(Runner):
+			lot = 'my_lot'
+			tasks = {'write': Write()}
+
+		return MyRunner()
+
+	def test_interrupted(self):
+		with self.assertRaises(ValueError):
+			self.make_runner(fail=True).run()
+		self.assertEqual(os.listdir(TEST_DIR), [])
+
+		self.make_runner().run()
+		self.assertEqual(os.listdir(TEST_DIR), ['my_lot_out.txt'])
+		fname = os.path.join(TEST_DIR, 'my_lot_out.txt')
+		self.assertEqual(open(fname).read(), 'partial and the rest')
+
+	def test_not_atomic(self):
+		with self.assertRaises(ValueError):
+			self.make_runner(fail=True, atomic=False).run()
+		self.assertEqual(os.listdir(TEST_DIR), ['my_lot_out.txt'])
+
+	def test_folder(self):
+
+		def make_runner(fail):
+			class Fill(Task):
+				outputs = Folder(TEST_DIR, 'out')
+				def run(self):
+					self.outputs.open('a.txt', 'w').write('a')
+					if fail:
+						raise ValueError('oops')
+					self.outputs.open('b.txt', 'w').write('b')
+
+			class MyRunner(Runner):
+				lot = 'my_lot'
+				tasks = {'fill': Fill()}
+
+			return MyRunner()
+
+		with self.assertRaises(ValueError):
+			make_runner(fail=True).run()
+		self.assertEqual(os.listdir(TEST_DIR), [])
+
+		# the rerun isn't stopped by what the failed attempt wrote
+		make_runner(fail=False).run()
+		folder = os.path.join(TEST_DIR, 'my_lot_out')
+		self.assertEqual(
+			sorted(os.listdir(folder)), ['.linguini_manifest', 'a.txt', 'b.txt'])
+
+
+class TestKeepGoing(TestCase):
+
+	def setUp(self):
+		os.mkdir(TEST_DIR)
+
+	def tearDown(self):
+		shutil.rmtree(TEST_DIR)
+
+	def make_runner(self):
+
+		def make_step(name, fail=False):
+			class Step(Task):
+				outputs = File(TEST_DIR, '%s.txt' % name)
+				def run(self):
+					if fail:
+						raise ValueError('bad shard')
+					self.outputs.open('w').write(name)
+			return Step()
+
+		class MyRunner(Runner):
+			lot = 'my_lot'
+			tasks = {
+				'a': make_step('a', fail=True),
+				'b': (make_step('b'), 'a'),
+				'c': make_step('c'),
+				'd': (make_step('d'), 'c'),
+				'e': (make_step('e'), 'b', 'd'),
+			}
+
+		return MyRunner()
+
+	def check(self, **kwargs):
+		with self.assertRaises(RunnerException) as context:
+			self.make_runner().run(keep_going=True, **kwargs)
+		message = str(context.exception)
+		self.assertTrue('bad shard' in message)
+		self.assertTrue('b, e' in message)
+		self.assertEqual(
+			sorted(os.listdir(TEST_DIR)), ['my_lot_c.txt', 'my_lot_d.txt'])
+
+	def test_serial(self):
+		self.check()
+
+	def test_parallel(self):
+		self.check(workers=2)
+
+
+class TestCheckpoint(TestCase):
+
+	def setUp(self):
+		os.mkdir(TEST_DIR)
+
+	def tearDown(self):
+		shutil.rmtree(TEST_DIR)
+
+	def make_runner(self, done, fail_at=None):
+
+		class Count(Task):
+			checkpoint_path = TEST_DIR
+			outputs = File(TEST_DIR, 'count.txt')
+			def run(self):
+				out = self.outputs.open('a')
+				for i in range(self.restore(0), 5):
+					if i == fail_at:
+						raise ValueError('interrupted')
+					done.append(i)
+					out.write('%d\n' % i)
+					out.flush()
+					self.checkpoint(i + 1)
+				out.close()
+
+		class MyRunner(Runner):
+			lot = 'my_lot'
+			tasks = {'count': Count()}
+
+		return MyRunner()
+
+	def test_resume(self):
+		done = []
+		with self.assertRaises(ValueError):
+			self.make_runner(done, fail_at=3).run()
+		self.assertEqual(done, [0, 1, 2])
+		self.assertEqual(sorted(os.listdir(TEST_DIR)), [
+			'my_lot_count.checkpoint.partial', 'my_lot_count.txt.partial'])
+
+		# the rerun picks up where the last attempt stopped, writing on 
+		# to its staged output, and the checkpoint is removed once the 
+		# task is done
+		self.make_runner(done).run()
+		self.assertEqual(done, [0, 1, 2, 3, 4])
+		self.assertEqual(os.listdir(TEST_DIR), ['my_lot_count.txt'])
+		fname = os.path.join(TEST_DIR, 'my_lot_count.txt')
+		self.assertEqual(open(fname).read().split(), list('01234'))
+
+	def test_clobber(self):
+		done = []
+		with self.assertRaises(ValueError):
+			self.make_runner(done, fail_at=3).run()
+
+		# clobbering starts over
+		self.make_runner(done).run(clobber=True)
+		self.assertEqual(done, [0, 1, 2, 0, 1, 2, 3, 4])
+		fname = os.path.join(TEST_DIR, 'my_lot_count.txt')
+		self.assertEqual(open(fname).read().split(), list('01234'))
+
+
 class TestRunner(TestCase):
 
 	def test_null_runner(self):